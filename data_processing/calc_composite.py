@@ -9,6 +9,8 @@ Description:  Calculates a composite
 
 import sys, os, pdb
 import argparse
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
 import numpy, pandas
 import xray
 
@@ -35,9 +37,17 @@ except ImportError:
 # Define functions
 
 season_months = {'annual': None, 'DJF': (12, 1, 2), 'MAM': (3, 4, 5), 'JJA': (6, 7, 8), 'SON': (9, 10, 11)}
+season_order = ['annual', 'DJF', 'MAM', 'JJA', 'SON']
 
-def get_datetimes(darray, date_file):
-    """Generate a list of datetimes common to darray and date_file."""
+_shared_data = None   # (time, space) data matrix used by the permutation test workers (missing values zero-filled)
+_shared_valid = None  # (time, space) valid data indicator (None if there are no missing values)
+
+def get_date_indexes(darray, date_file):
+    """Get the time axis positions of darray that are listed in date_file.
+
+    Returns all positions if there is no date_file. 
+
+    """
 
     try:
         time_values = darray['time'].values
@@ -45,103 +55,575 @@ def get_datetimes(darray, date_file):
         time_values = darray.index.values 
 
     if date_file:
-        time_dim = map(str, time_values)     
         date_list, date_metadata = gio.read_dates(date_file)
+        match_indexes, miss_indexes = uconv.match_dates(date_list, time_values)
+    else:
+        match_indexes = numpy.arange(len(time_values))
+        date_metadata = None
+
+    return match_indexes, date_metadata
+
+
+def get_season_masks(months):
+    """Get a (season, time) boolean array indicating the season of each time step.
+
+    The rows follow season_order.
+
+    """
+
+    masks = numpy.zeros([len(season_order), len(months)], dtype=bool)
+    for index, season in enumerate(season_order):
+        if season_months[season]:
+            masks[index, :] = numpy.in1d(months, season_months[season])
+        else:
+            masks[index, :] = True
+
+    return masks
+
+
+def accumulate_moments(data, groups, chunk_size=1000, lag1=False):
+    """Accumulate the sum, sum of squares and count for groups of time steps.
+
+    All groups are updated together in a single traversal of the time axis, 
+    with the sums for each chunk calculated as a (group, time) x (time, space) 
+    matrix product. Only one chunk of data is read at a time, so data can be 
+    an xray.DataArray that has not been loaded into memory.
+
+    Missing (non-finite) values are excluded, so the counts are the number of 
+    valid time steps in each group at each point.
+
+    If lag1 is True, the sum of the products of consecutive group members, 
+    and the sum and number of the consecutive pairs, are also accumulated 
+    (see ar1_effective_sample_size). Pairs with a missing value are excluded.
+
+    Args:
+      data (numpy.ndarray or xray.DataArray): Time must be the first axis
+      groups (numpy.ndarray): (group, time) boolean array of group membership
+
+    Returns:
+      sums, sums_sq (numpy.ndarray): (group, ...) sums and sums of squares
+      counts (numpy.ndarray): (group, ...) number of valid time steps
+      lag1_terms (tuple): (lag_products, pair_sums, pair_counts) arrays if lag1, else None 
+
+    """
+
+    ntime = data.shape[0]
+    spatial_shape = tuple(data.shape[1:])
+    ngroups = groups.shape[0]
+    weights_all = groups.astype(float)
+    
+    sums = numpy.zeros([ngroups, numpy.prod(spatial_shape)])
+    sums_sq = numpy.zeros(sums.shape)
+    counts = numpy.zeros(sums.shape)
+    if lag1:
+        lag_products = numpy.zeros(sums.shape)
+        pair_sums = numpy.zeros(sums.shape)
+        pair_counts = numpy.zeros(sums.shape)
+        last = numpy.zeros(sums.shape)
+        last_valid = numpy.zeros(sums.shape, dtype=bool)
+        started = numpy.zeros(ngroups, dtype=bool)
+
+    for start in xrange(0, ntime, chunk_size):
+        chunk = numpy.asarray(data[start:start + chunk_size], dtype=numpy.float64).reshape(-1, sums.shape[1])
+        valid = numpy.isfinite(chunk)
+        chunk = numpy.where(valid, chunk, 0)
+        weights = weights_all[:, start:start + chunk_size]
+        sums += numpy.dot(weights, chunk)
+        sums_sq += numpy.dot(weights, chunk**2)
+        counts += numpy.dot(weights, valid)
+        
+        if lag1:
+            for group in xrange(ngroups):
+                members = chunk[groups[group, start:start + chunk_size], :]
+                members_valid = valid[groups[group, start:start + chunk_size], :]
+                if not members.shape[0]:
+                    continue
+                if started[group]:
+                    members = numpy.vstack([last[group:group + 1, :], members])
+                    members_valid = numpy.vstack([last_valid[group:group + 1, :], members_valid])
+                else:
+                    started[group] = True
+                pairs_valid = members_valid[:-1, :] & members_valid[1:, :]
+                lag_products[group, :] += (members[:-1, :] * members[1:, :]).sum(axis=0)
+                pair_sums[group, :] += ((members[:-1, :] + members[1:, :]) * pairs_valid).sum(axis=0)
+                pair_counts[group, :] += pairs_valid.sum(axis=0)
+                last[group, :] = members[-1, :]
+                last_valid[group, :] = members_valid[-1, :]
+    
+    new_shape = (ngroups,) + spatial_shape
     
-        match_dates, miss_dates = uconv.match_dates(date_list, time_dim)
-        match_dates = map(numpy.datetime64, match_dates)
+    if lag1:
+        lag1_terms = (lag_products.reshape(new_shape), pair_sums.reshape(new_shape), pair_counts.reshape(new_shape))
+    else:
+        lag1_terms = None
+
+    return sums.reshape(new_shape), sums_sq.reshape(new_shape), counts.reshape(new_shape), lag1_terms
+
 
+def ar1_effective_sample_size(sums, sums_sq, counts, lag1_terms):
+    """Calculate the lag-1 autoregressive effective sample size from accumulated moments.
+
+    Gives the same result as uconv.effective_sample_size(method='ar1')
+    applied to the time steps in each group, i.e. the lag-1 autocovariance
+    sum((x_i - m)(x_i+1 - m)) is expanded in terms of the accumulated 
+    sum of x_i * x_i+1 and the sum and number of the (x_i, x_i+1) pairs.
+
+    """
+
+    lag_products, pair_sums, pair_counts = lag1_terms
+    n = counts
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        mean = sums / n
+        acov0 = sums_sq - n * mean**2
+        acov1 = lag_products - mean * pair_sums + pair_counts * mean**2
+        r_1 = acov1 / acov0
+        n_eff = n * (1 - r_1) / (1 + r_1)
+
+    return n_eff
+
+
+def _init_permutation(shared, shared_valid, shape):
+    """Attach a worker process to the shared data (and valid data) matrix."""
+
+    global _shared_data, _shared_valid
+
+    _shared_data = numpy.frombuffer(shared).reshape(shape)
+    _shared_valid = numpy.frombuffer(shared_valid).reshape(shape) if shared_valid is not None else None
+
+
+def _permutation_batch(args):
+    """Calculate the composite means for a batch of random date sets.
+
+    Each random date set has the same number of days in each calendar month
+    as the real composite. All the resamples and seasons in the batch are 
+    evaluated with a single (resample * season, time) x (time, space) 
+    matrix product. Missing values are excluded (i.e. each mean is divided 
+    by the number of valid values at each point).
+
+    Returns:
+      numpy.ndarray: (resample, season, space) composite means (NaN where 
+        there are no valid values)
+
+    """
+
+    seed, nsamples, month_positions, month_counts, season_indicators = args
+
+    state = numpy.random.RandomState(seed)
+    nseasons, ntime = season_indicators.shape
+
+    weights = numpy.zeros([nsamples, nseasons, ntime])
+    for sample in xrange(nsamples):
+        indicator = numpy.zeros(ntime)
+        for positions, count in zip(month_positions, month_counts):
+            if count:
+                indicator[state.choice(positions, count, replace=False)] = 1
+        weights[sample, :, :] = season_indicators * indicator
+
+    weights = weights.reshape(nsamples * nseasons, ntime)
+    sums = numpy.dot(weights, _shared_data)
+    if _shared_valid is None:
+        counts = weights.sum(axis=1)[:, numpy.newaxis]
     else:
-        match_dates = time_values
-        date_metadata = None
+        counts = numpy.dot(weights, _shared_valid)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        means = sums / counts
+
+    return means.reshape(nsamples, nseasons, -1).astype(numpy.float32)
+
+
+def permutation_test(data, selected, months, season_masks, composite_means, all_means, 
+                     nresamples=1000, workers=1, seed=None):
+    """Permutation test of the composite means.
+
+    The composite means are compared to the distribution of means 
+    obtained from random date sets with the same number of days in each
+    calendar month (and therefore season) as the composite. The data matrix 
+    is placed in shared memory once and batches of random date sets are 
+    spread across a pool of worker processes.
+
+    Missing values are excluded from the means. The p-values (and null 
+    distribution percentiles) are NaN wherever the composite mean or any 
+    of the random composite means is undefined (e.g. at points with no 
+    valid data, or for seasons with no composite days).
+
+    Args:
+      data (numpy.ndarray): (time, lat, lon) data
+      selected (numpy.ndarray): Boolean array indicating the composite time steps
+      months (numpy.ndarray): Month of each time step
+      season_masks (numpy.ndarray): (season, time) boolean array
+      composite_means, all_means (numpy.ndarray): (season, lat, lon) means of the 
+        composite and all the data
+
+    Returns:
+      pvals (numpy.ndarray): (season, lat, lon) two-sided p-values
+      null_lower, null_upper (numpy.ndarray): (season, lat, lon) 2.5 and 97.5 
+        percentiles of the random composite means
+
+    """
+
+    ntime = data.shape[0]
+    spatial_shape = data.shape[1:]
+    nseasons = season_masks.shape[0]
+
+    valid = numpy.isfinite(data.reshape(ntime, -1))
+    shared = RawArray('d', data.size)
+    data_matrix = numpy.frombuffer(shared).reshape(ntime, -1)
+    data_matrix[:] = numpy.where(valid, data.reshape(ntime, -1), 0)
+    if valid.all():
+        shared_valid = None
+    else:
+        shared_valid = RawArray('d', data.size)
+        numpy.frombuffer(shared_valid).reshape(ntime, -1)[:] = valid
+
+    month_positions = [numpy.where(months == month)[0] for month in range(1, 13)]
+    month_counts = [int((selected & (months == month)).sum()) for month in range(1, 13)]
+    season_counts = (season_masks & selected).sum(axis=1)
+    season_indicators = season_masks.astype(float)
+
+    nbatches = max(workers, 1) * 4
+    batch_sizes = [len(batch) for batch in numpy.array_split(numpy.arange(nresamples), nbatches)]
+    seeds = numpy.random.RandomState(seed).randint(0, 2**31 - 1, nbatches)
+    tasks = [(seeds[i], batch_sizes[i], month_positions, month_counts, season_indicators) for i in range(nbatches) if batch_sizes[i]]
+
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer=_init_permutation, initargs=(shared, shared_valid, data_matrix.shape))
+        null_means = pool.map(_permutation_batch, tasks)
+        pool.close()
+        pool.join()
+    else:
+        _init_permutation(shared, shared_valid, data_matrix.shape)
+        null_means = map(_permutation_batch, tasks)
+    null_means = numpy.concatenate(null_means)
+
+    composite_anomaly = numpy.abs(composite_means - all_means).reshape(nseasons, -1)
+    null_anomaly = numpy.abs(null_means - all_means.reshape(nseasons, -1))
+    with numpy.errstate(invalid='ignore'):
+        pvals = ((null_anomaly >= composite_anomaly).sum(axis=0) + 1) / float(nresamples + 1)
+    null_lower, null_upper = numpy.percentile(null_means, [2.5, 97.5], axis=0)
+
+    undefined = numpy.isnan(composite_anomaly) | numpy.isnan(null_anomaly).any(axis=0)
+    undefined[season_counts == 0, :] = True
+    for result in [pvals, null_lower, null_upper]:
+        result[undefined] = numpy.nan
+
+    new_shape = (nseasons,) + spatial_shape
+
+    return pvals.reshape(new_shape), null_lower.reshape(new_shape), null_upper.reshape(new_shape)
 
-    return match_dates, date_metadata
 
+def group_effective_sample_size(data, group, index, sums, sums_sq, counts, lag1_terms, sig_method, max_lag):
+    """Calculate the effective sample size for one group of time steps.
 
-def calc_composites(darray, dtlist, sig_test=True):
-    """Calculate the composites and define their attributes."""
+    Uses the accumulated lag-1 terms if available (i.e. when streaming),
+    otherwise the group time steps are extracted from data.
+
+    """
+
+    if lag1_terms:
+        n_eff = ar1_effective_sample_size(sums[index, ...], sums_sq[index, ...], counts[index, ...], 
+                                          tuple(term[index, ...] for term in lag1_terms))
+    else:
+        n_eff = uconv.effective_sample_size(data[group, ...], method=sig_method, max_lag=max_lag)
+
+    return n_eff
+
+
+def calc_composites(darray, date_indexes_list, sig_tests, sig_method='full', max_lag=None,
+                    nresamples=1000, workers=1, streaming=False, chunk_size=1000):
+    """Calculate the composites and define their attributes.
+
+    The moments of every composite (i.e. set of selected dates) and the full
+    record for every season are accumulated in one pass and the composite 
+    means and p-values are derived from them. The full record moments are 
+    calculated once and shared by all the composites.
+
+    Args:
+      darray (xray.DataArray): Input data
+      date_indexes_list (list): Time axis positions for each composite
+      sig_tests (list): Whether to perform the significance test for each composite
+      sig_method (str): full, truncated or ar1 (t-test with that effective 
+        sample size method) or permutation
+      streaming (bool): Read chunk_size time steps at a time rather than loading 
+        all the data into memory (sig_method must be ar1)
+
+    """
 
     standard_name = darray.attrs['standard_name']
-    darray_selection = darray.sel(time=dtlist)
-
-    composite_means = {}
-    pvals = {}
-    composite_mean_atts = {}
-    pval_atts = {}    
-    for season, months in season_months.iteritems():
-        if season == 'annual':
-            ntsteps = darray_selection['time'].shape[0]
-            composite_means['annual'] = darray_selection.mean(dim='time').values
-            
-            if sig_test:
-                pvals['annual'], pval_atts['annual'] = uconv.calc_significance(darray_selection.values, 
-                                                                               darray.values, 'p_value_'+season)
-        else: 
-            months_subset = pandas.to_datetime(darray_selection['time'].values).month
-            bools_subset = (months_subset == season_months[season][0]) + (months_subset == season_months[season][1]) + (months_subset == season_months[season][2])
-            data_subset = darray_selection.loc[bools_subset]
-            ntsteps = data_subset['time'].shape[0]
-            composite_means[season] = data_subset.mean(dim='time').values
-
-            if sig_test:
-                months_all = pandas.to_datetime(darray['time'].values).month
-                bools_all = (months_all == season_months[season][0]) + (months_all == season_months[season][1]) + (months_all == season_months[season][2])
-                data_all = darray.loc[bools_all]
-                pvals[season], pval_atts[season] = uconv.calc_significance(data_subset.values, 
-                                                                           data_all.values, 'p_value_'+season)
-
-        composite_mean_atts[season] = {'standard_name': standard_name+'_'+season,
-                                       'long_name': standard_name+'_'+season,
-                                       'units': darray.attrs['units'],
-                                       'notes': 'Composite mean for %s season. %s time steps included.' %(season, str(ntsteps))}
-
-    return composite_means, composite_mean_atts, pvals, pval_atts
+    time_values = darray['time'].values
+    if streaming:
+        assert sig_method == 'ar1' or not any(sig_tests), \
+        "Only the ar1 sig_method can be used when streaming"
+        data = darray
+    else:
+        data = darray.values
+
+    months = numpy.asarray(pandas.to_datetime(time_values).month)
+    season_masks = get_season_masks(months)
+    nseasons = len(season_order)
+
+    selections = []
+    group_list = []
+    for date_indexes in date_indexes_list:
+        selected = numpy.zeros(len(time_values), dtype=bool)
+        selected[date_indexes] = True
+        selections.append(selected)
+        group_list.append(season_masks & selected)
+    group_list.append(season_masks)
+    groups = numpy.vstack(group_list)
+    
+    sums, sums_sq, counts, lag1_terms = accumulate_moments(data, groups, chunk_size=chunk_size, 
+                                                           lag1=streaming and any(sig_tests))
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        means = sums / counts
+        variances = sums_sq / counts - means**2
+    all_means = means[-nseasons:, ...]
+
+    results = []
+    for composite_num, selected in enumerate(selections):
+        composite_means = {}
+        pvals = {}
+        composite_mean_atts = {}
+        pval_atts = {}    
+        null_bounds = {}
+        
+        if sig_tests[composite_num] and sig_method == 'permutation':
+            start = composite_num * nseasons
+            perm_pvals, null_lower, null_upper = permutation_test(data, selected, months, season_masks, 
+                                                                  means[start:start + nseasons, ...], all_means,
+                                                                  nresamples=nresamples, workers=workers)
+
+        for season_num, season in enumerate(season_order):
+            index = composite_num * nseasons + season_num
+            ntsteps = int(groups[index, :].sum())
+            composite_means[season] = means[index, ...]
+        
+            if sig_tests[composite_num] and sig_method == 'permutation':
+                pvals[season] = perm_pvals[season_num, ...]
+                pval_atts[season] = {'standard_name': 'p_value_'+season,
+                                     'long_name': 'p_value_'+season,
+                                     'units': ' ',
+                                     'notes': 'Permutation test: %i random date sets with the same number of days in each calendar month' %(nresamples)}
+                null_bounds[season] = (null_lower[season_num, ...], null_upper[season_num, ...])
+            elif sig_tests[composite_num]:
+                n_eff = group_effective_sample_size(data, season_masks[season_num, :] & selected, index, 
+                                                    sums, sums_sq, counts, lag1_terms, sig_method, max_lag)
+                pvals[season], pval_atts[season] = uconv.calc_significance_from_moments(means[index, ...], variances[index, ...], 
+                                                                                        counts[index, ...], n_eff, all_means[season_num, ...], 
+                                                                                        'p_value_'+season, 
+                                                                                        method=sig_method, max_lag=max_lag)
+
+            composite_mean_atts[season] = {'standard_name': standard_name+'_'+season,
+                                           'long_name': standard_name+'_'+season,
+                                           'units': darray.attrs['units'],
+                                           'notes': 'Composite mean for %s season. %s time steps included.' %(season, str(ntsteps))}
+
+        results.append((composite_means, composite_mean_atts, pvals, pval_atts, null_bounds))
+
+    return results
+
+
+def calc_lagged_composites(darray, date_indexes, lags, sig_test=True, sig_method='full', max_lag=None,
+                           streaming=False, chunk_size=1000):
+    """Calculate composites at a range of lags relative to the dates.
+
+    The lag l composite is the mean of the time steps l steps after each date, 
+    with the season determined by the date itself (not the lagged time step). 
+    Each lag/season composite is a group in a single accumulate_moments pass, 
+    so each time step is read once regardless of the number of lags. 
+    The significance test compares each lag composite with the full record 
+    mean for the season.
+
+    Args:
+      darray (xray.DataArray): Input data
+      date_indexes (numpy.ndarray): Time axis positions of the dates
+      lags (list): Lags (in time steps)
+
+    Returns:
+      means, pvals (numpy.ndarray): (lag, season, lat, lon) arrays (pvals is None if not sig_test)
+      counts (numpy.ndarray): (lag, season) number of time steps in each composite
+
+    """
+
+    time_values = darray['time'].values
+    ntime = len(time_values)
+    if streaming:
+        assert sig_method == 'ar1' or not sig_test, \
+        "Only the ar1 sig_method can be used when streaming"
+        data = darray
+    else:
+        data = darray.values
+
+    months = numpy.asarray(pandas.to_datetime(time_values).month)
+    season_masks = get_season_masks(months)
+    date_seasons = season_masks[:, date_indexes]
+    nseasons = len(season_order)
+    nlags = len(lags)
+
+    groups = numpy.zeros([nlags * nseasons + nseasons, ntime], dtype=bool)
+    for lag_num, lag in enumerate(lags):
+        lagged_indexes = date_indexes + lag
+        valid = (lagged_indexes >= 0) & (lagged_indexes < ntime)
+        for season_num in range(nseasons):
+            groups[lag_num * nseasons + season_num, lagged_indexes[valid & date_seasons[season_num, :]]] = True
+    groups[-nseasons:, :] = season_masks
+    group_sizes = groups.sum(axis=1)
+
+    sums, sums_sq, counts, lag1_terms = accumulate_moments(data, groups, chunk_size=chunk_size, 
+                                                           lag1=streaming and sig_test)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        means = sums / counts
+        variances = sums_sq / counts - means**2
+    all_means = means[-nseasons:, ...]
+
+    spatial_shape = means.shape[1:]
+    pvals = numpy.ones((nlags, nseasons) + spatial_shape) * numpy.nan if sig_test else None
+    for lag_num in range(nlags):
+        for season_num in range(nseasons):
+            index = lag_num * nseasons + season_num
+            if sig_test and group_sizes[index] > 1:
+                n_eff = group_effective_sample_size(data, groups[index, :], index, sums, sums_sq, counts, 
+                                                    lag1_terms, sig_method, max_lag)
+                pvals[lag_num, season_num, ...], pval_atts = uconv.calc_significance_from_moments(means[index, ...], variances[index, ...], 
+                                                                                                  counts[index, ...], n_eff, 
+                                                                                                  all_means[season_num, ...], 'p_value',
+                                                                                                  method=sig_method, max_lag=max_lag)
+    
+    new_shape = (nlags, nseasons) + spatial_shape
 
+    return means[:-nseasons, ...].reshape(new_shape), pvals, group_sizes[:-nseasons].reshape(nlags, nseasons)
 
-def main(inargs):
-    """Run the program."""
 
-    # Read the data
-    dset_in = xray.open_dataset(inargs.infile)
-    #gio.check_xrayDataset(dset_in, inargs.var)
+def write_lagged_composite(outfile, var, darray, lags, means, pvals, counts, sig_method, 
+                           global_atts, output_metadata):
+    """Write a lagged composite output file."""
 
-    subset_dict = gio.get_subset_kwargs(inargs)
-    darray = dset_in[inargs.var].sel(**subset_dict)
+    standard_name = darray.attrs['standard_name']
+    dims = ['lag', 'season', 'latitude', 'longitude']
 
-    assert darray.dims == ('time', 'latitude', 'longitude'), \
-    "Order of the data must be time, latitude, longitude"
+    d = {}
+    d['lag'] = ('lag', numpy.array(lags))
+    d['season'] = ('season', season_order)
+    d['latitude'] = darray['latitude']
+    d['longitude'] = darray['longitude']
+    d[var] = (dims, means)
+    d['count'] = (['lag', 'season'], counts.astype(int))
+    if pvals is not None:
+        d['p'] = (dims, pvals)
 
-    # Generate datetime list
-    dt_list, dt_list_metadata = get_datetimes(darray, inargs.date_file)
+    dset_out = xray.Dataset(d)
+
+    dset_out['lag'].attrs = {'long_name': 'lag', 
+                             'units': 'time steps',
+                             'notes': 'Time steps after each date (negative values are before)'}
+    dset_out[var].attrs = {'standard_name': standard_name,
+                           'long_name': standard_name,
+                           'units': darray.attrs['units'],
+                           'notes': 'Lagged composite mean. Season refers to the season of the (unlagged) date.'}
+    dset_out['count'].attrs = {'long_name': 'number_of_time_steps', 'units': ''}
+    if pvals is not None:
+        dset_out['p'].attrs = {'standard_name': 'p_value',
+                               'long_name': 'p_value',
+                               'units': ' ',
+                               'notes': 'One sample t-test against the full record seasonal mean, with sample size adjusted for autocorrelation (%s method)' %(sig_method)}
+
+    gio.set_global_atts(dset_out, global_atts, output_metadata)
+    dset_out.to_netcdf(outfile)
 
-    # Calculate the composites
-    if not inargs.date_file:
-        inargs.no_sig = True    
-    cmeans, cmean_atts, pvals, pval_atts = calc_composites(darray, dt_list, sig_test=not inargs.no_sig) 
 
-    # Write the output file
+def write_composite(outfile, var, darray, cmeans, cmean_atts, pvals, pval_atts, null_bounds, 
+                    global_atts, output_metadata):
+    """Write a composite output file."""
+
     d = {}
     d['latitude'] = darray['latitude']
     d['longitude'] = darray['longitude']
 
     for season in season_months.keys(): 
-        d[inargs.var+'_'+season] = (['latitude', 'longitude'], cmeans[season])
-        if not inargs.no_sig:
+        d[var+'_'+season] = (['latitude', 'longitude'], cmeans[season])
+        if pvals:
             d['p_'+season] = (['latitude', 'longitude'], pvals[season])
+        if null_bounds:
+            d['null_lower_'+season] = (['latitude', 'longitude'], null_bounds[season][0])
+            d['null_upper_'+season] = (['latitude', 'longitude'], null_bounds[season][1])
 
     dset_out = xray.Dataset(d)
 
     for season in season_months.keys(): 
-        dset_out[inargs.var+'_'+season].attrs = cmean_atts[season]
-        if not inargs.no_sig:
+        dset_out[var+'_'+season].attrs = cmean_atts[season]
+        if pvals:
             dset_out['p_'+season].attrs = pval_atts[season]
+        for bound, percentile in [('lower', '2.5'), ('upper', '97.5')]:
+            if null_bounds:
+                dset_out['null_%s_%s' %(bound, season)].attrs = {'standard_name': 'null_%s_%s' %(bound, season),
+                                                                 'long_name': 'null_%s_%s' %(bound, season),
+                                                                 'units': darray.attrs['units'],
+                                                                 'notes': '%s percentile of the random date set composite means' %(percentile)}
     
-    output_metadata = {inargs.infile: dset_in.attrs['history'],}
-    if inargs.date_file:
-        output_metadata[inargs.date_file] = dt_list_metadata
+    gio.set_global_atts(dset_out, global_atts, output_metadata)
+    dset_out.to_netcdf(outfile, format='NETCDF3_CLASSIC')
 
-    gio.set_global_atts(dset_out, dset_in.attrs, output_metadata)
-    dset_out.to_netcdf(inargs.outfile, format='NETCDF3_CLASSIC')
+
+def main(inargs):
+    """Run the program."""
+
+    # Read the data
+    dset_in = xray.open_dataset(inargs.infile)
+    #gio.check_xrayDataset(dset_in, inargs.var)
+
+    subset_dict = gio.get_subset_kwargs(inargs)
+    darray = dset_in[inargs.var].sel(**subset_dict)
+
+    assert darray.dims == ('time', 'latitude', 'longitude'), \
+    "Order of the data must be time, latitude, longitude"
+
+    # Lagged composite
+    if inargs.lags:
+        assert inargs.date_file, "A date file is required for lagged composites"
+        assert not inargs.extra_composite, "--extra_composite cannot be used with --lags"
+        assert inargs.sig_method != 'permutation', "The permutation sig_method cannot be used with --lags"
+        
+        min_lag, max_lag = inargs.lags
+        lags = range(min_lag, max_lag + 1)
+        date_indexes, date_metadata = get_date_indexes(darray, inargs.date_file)
+        means, pvals, counts = calc_lagged_composites(darray, date_indexes, lags, sig_test=not inargs.no_sig,
+                                                      sig_method=inargs.sig_method, max_lag=inargs.max_lag,
+                                                      streaming=inargs.streaming, chunk_size=inargs.chunk_size)
+
+        output_metadata = {inargs.infile: dset_in.attrs['history'], inargs.date_file: date_metadata}
+        write_lagged_composite(inargs.outfile, inargs.var, darray, lags, means, pvals, counts, inargs.sig_method, 
+                               dset_in.attrs.copy(), output_metadata)
+        return
+
+    # Generate the date lists (the significance test is only done for date file composites)
+    composite_list = [(inargs.date_file, inargs.outfile)] + inargs.extra_composite
+    date_indexes_list = []
+    date_metadata_list = []
+    sig_tests = []
+    for date_file, outfile in composite_list:
+        if date_file == 'all':
+            date_file = None
+        date_indexes, date_metadata = get_date_indexes(darray, date_file)
+        date_indexes_list.append(date_indexes)
+        date_metadata_list.append(date_metadata)
+        sig_tests.append(bool(date_file) and not inargs.no_sig)
+
+    # Calculate the composites
+    results = calc_composites(darray, date_indexes_list, sig_tests,
+                              sig_method=inargs.sig_method, max_lag=inargs.max_lag,
+                              nresamples=inargs.nresamples, workers=inargs.workers,
+                              streaming=inargs.streaming, chunk_size=inargs.chunk_size) 
+
+    # Write the output files
+    for composite_num, (date_file, outfile) in enumerate(composite_list):
+        cmeans, cmean_atts, pvals, pval_atts, null_bounds = results[composite_num]
+
+        output_metadata = {inargs.infile: dset_in.attrs['history'],}
+        if date_metadata_list[composite_num]:
+            output_metadata[date_file] = date_metadata_list[composite_num]
+
+        write_composite(outfile, inargs.var, darray, cmeans, cmean_atts, pvals, pval_atts, null_bounds,
+                        dset_in.attrs.copy(), output_metadata)
 
 
 if __name__ == '__main__':
@@ -154,6 +636,37 @@ example (vortex.earthsci.unimelb.edu.au):
   --date_file /mnt/meteo0/data/simmonds/dbirving/ERAInterim/data/zw3/figures/composites/env_amp_median-date-list_zw3-w19-va-stats-extent75pct-filter90pct_ERAInterim_500hPa_030day-runmean_native-mermax.txt 
   --region small --time 1980-01-01 1982-01-01
 
+  Several composites can be calculated from one read of the input data 
+  (the full record statistics are only calculated once):
+  python calc_composite.py sf_ERAInterim_500hPa_030day-runmean_native.nc sf sf-composite_all.nc 
+  --extra_composite dates_high.txt sf-composite_high.nc --extra_composite dates_low.txt sf-composite_low.nc 
+
+lags:
+  With --lags MIN_LAG MAX_LAG (e.g. --lags -10 10) the composite is calculated for each 
+  lag from MIN_LAG to MAX_LAG time steps relative to the dates in --date_file 
+  (negative lags are before the date). All lags are calculated in a single pass through
+  the data and written to one (lag, season, latitude, longitude) output variable.
+
+sig_method:
+  The p-value comes from a one sample t-test with the sample size adjusted for 
+  autocorrelation. The effective sample size can be estimated by:
+    full      : summing over all lags (Zieba2010, eq 12) [default]
+    truncated : summing over lags 1 to --max_lag only
+    ar1       : a lag-1 autoregressive approximation (cheapest)
+
+  Alternatively, the permutation method makes no assumption about the distribution 
+  of the data (e.g. for precipitation or sea ice). The composite mean is compared to the
+  means of --nresamples random date sets with the same number of days in each calendar month.
+  The 2.5 and 97.5 percentiles of those random composite means are also written to the 
+  output file (null_lower_* and null_upper_*). Use --workers to spread the work over 
+  several processes.
+
+streaming:
+  With --streaming the input data are read --chunk_size time steps at a time 
+  (instead of all at once) and the composite and climatology sums, sums of squares, 
+  counts and lag-1 products are accumulated as each chunk is read. This allows for
+  inputs that are larger than the available memory, but only --sig_method ar1 can be used.
+
 fixme:
   The time selector is broken (it fails once it gets to SON)
 
@@ -174,6 +687,11 @@ author:
 
     parser.add_argument("--date_file", type=str, default=None,
                         help="File containing dates to be included in composite")    
+    parser.add_argument("--extra_composite", type=str, nargs=2, action='append', default=[], 
+                        metavar=('DATE_FILE', 'OUTFILE'),
+                        help="Additional composite to calculate from the same input data (DATE_FILE can be 'all'). Can be used multiple times.")
+    parser.add_argument("--lags", type=int, nargs=2, metavar=('MIN_LAG', 'MAX_LAG'), default=None,
+                        help="Calculate a lagged composite for each of these lags (in time steps) [default = None]")
     parser.add_argument("--time", type=str, nargs=2, metavar=('START_DATE', 'END_DATE'),
                         help="Time period over which to calculate the composite [default = entire]")
     parser.add_argument("--region", type=str, choices=gio.regions.keys(),
@@ -181,6 +699,19 @@ author:
 
     parser.add_argument("--no_sig", action="store_true", default=False,
                         help="do not perform the significance testing [default: False]")
+    parser.add_argument("--sig_method", type=str, choices=('full', 'truncated', 'ar1', 'permutation'), default='full',
+                        help="effective sample size method for the t-test, or permutation test [default: full]")
+    parser.add_argument("--max_lag", type=int, default=None,
+                        help="maximum lag for the truncated sig_method [default: None]")
+    parser.add_argument("--nresamples", type=int, default=1000,
+                        help="number of random date sets for the permutation sig_method [default: 1000]")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes for the permutation sig_method [default: 1]")
+
+    parser.add_argument("--streaming", action="store_true", default=False,
+                        help="read the input data one chunk of time steps at a time [default: False]")
+    parser.add_argument("--chunk_size", type=int, default=1000,
+                        help="number of time steps read at a time [default: 1000]")
 
     args = parser.parse_args()            
 
@@ -0,0 +1,265 @@
+"""
+Filename:     calc_daily_anomaly.py
+Author:       Damien Irving, d.irving@student.unimelb.edu.au
+Description:  Calculate the anomaly with respect to the daily climatology
+              (i.e. cdo [runmean,N] -ydaysub infile -ydayavg infile)
+
+"""
+
+# Import general Python modules
+
+import os, sys, pdb
+import argparse, tempfile, shutil
+import itertools
+import numpy, pandas
+import xarray
+
+# Import my modules
+
+cwd = os.getcwd()
+repo_dir = '/'
+for directory in cwd.split('/')[1:]:
+    repo_dir = os.path.join(repo_dir, directory)
+    if directory == 'climate-analysis':
+        break
+
+modules_dir = os.path.join(repo_dir, 'modules')
+sys.path.append(modules_dir)
+
+try:
+    import general_io as gio
+    import running_mean as rmean
+except ImportError:
+    raise ImportError('Must run this script from anywhere within the climate-analysis git repo')
+
+
+# Define fuctions
+
+ndays_index = 12 * 31
+
+def day_of_year_index(times):
+    """Day of year index used by the cdo ydaystat operators.
+
+    cdo uses (month - 1) * 31 + day, so the 29th of February has its own
+    index (i.e. its climatology is the mean of the leap days only) and
+    every other date has the same index in leap and non-leap years.
+
+    """
+
+    dt_index = pandas.DatetimeIndex(times)
+
+    return numpy.array((dt_index.month - 1) * 31 + dt_index.day - 1)
+
+
+def calc_climatology(darray, doy, chunk_size):
+    """Calculate the daily climatology in one pass through the data.
+
+    The sums for each slab are calculated as a (day of year, time) x 
+    (time, space) matrix product. Like cdo ydayavg, the climatology is 
+    missing wherever any of the contributing values are missing.
+
+    Args:
+      darray (xarray.DataArray): Data (time must be the first axis)
+      doy (numpy.ndarray): Day of year index for each time step
+      chunk_size (int): Number of time steps to read at once
+
+    """
+
+    shape = (ndays_index,) + darray.shape[1:]
+    npoints = int(numpy.prod(darray.shape[1:]))
+    sums = numpy.zeros([ndays_index, npoints])
+    valid_counts = numpy.zeros(sums.shape)
+    counts = numpy.zeros(ndays_index)
+
+    ntime = darray.shape[0]
+    for start in xrange(0, ntime, chunk_size):
+        slab = numpy.asarray(darray[start:start + chunk_size].values, dtype=numpy.float64).reshape(-1, npoints)
+        slab_doy = doy[start:start + chunk_size]
+        weights = (numpy.arange(ndays_index)[:, numpy.newaxis] == slab_doy[numpy.newaxis, :]).astype(float)
+        valid = ~numpy.isnan(slab)
+
+        sums += numpy.dot(weights, numpy.where(valid, slab, 0))
+        valid_counts += numpy.dot(weights, valid)
+        counts += weights.sum(axis=1)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        clim = sums / counts[:, numpy.newaxis]
+    clim[valid_counts < counts[:, numpy.newaxis]] = numpy.nan
+
+    return clim.reshape(shape)
+
+
+def anomaly_slabs(darray, doy, clim, chunk_size):
+    """Subtract the climatology from the data, one slab at a time (a generator)."""
+
+    ntime = darray.shape[0]
+    for start in xrange(0, ntime, chunk_size):
+        slab = numpy.asarray(darray[start:start + chunk_size].values, dtype=numpy.float64)
+        slab -= clim[doy[start:start + chunk_size]]
+
+        yield slab
+
+
+def calc_anomaly(darray, chunk_size, runmean_window=None):
+    """Calculate the anomaly with respect to the daily climatology.
+
+    The data are read twice, one slab at a time: once to calculate the
+    climatology and once (as the returned slabs are consumed) to subtract 
+    it and apply the running mean.
+
+    Args:
+      darray (xarray.DataArray): Data (time must be the first axis)
+      chunk_size (int): Number of time steps to read at once
+      runmean_window (int, optional): Centred running mean window,
+        applied to the anomaly (like cdo runmean, only complete
+        windows are retained)
+
+    Returns:
+      A generator of anomaly slabs and the time axis values for the 
+      full (concatenated) anomaly
+
+    """
+
+    assert darray.dims[0] == 'time', "Time must be the first dimension"
+
+    times = darray['time'].values
+    doy = day_of_year_index(times)
+    clim = calc_climatology(darray, doy, chunk_size)
+    slabs = anomaly_slabs(darray, doy, clim, chunk_size)
+
+    if runmean_window:
+        slabs = rmean.running_mean_chunks(slabs, runmean_window)
+        times = rmean.running_mean_times(times, runmean_window)
+
+    return slabs, times
+
+
+def get_variables(dset):
+    """Get the data variables that have time as the first dimension (excluding bounds)."""
+
+    bounds_vars = [dset[var].attrs['bounds'] for var in dset.variables if 'bounds' in dset[var].attrs]
+
+    var_list = []
+    for var in dset.data_vars:
+        if dset[var].dims and dset[var].dims[0] == 'time' and not var in bounds_vars:
+            var_list.append(var)
+
+    return var_list
+
+
+def write_slab(outfile, var_list, darrays, slabs, times, time_atts, var_atts, global_atts, outfile_metadata):
+    """Write one time slab of the anomaly data for all variables."""
+
+    d = {}
+    for var, darray, slab in zip(var_list, darrays, slabs):
+        for dim in darray.dims[1:]:
+            d[dim] = darray[dim]
+        out_dtype = darray.dtype if darray.dtype.kind == 'f' else numpy.float64
+        d[var] = (darray.dims, slab.astype(out_dtype))
+    d['time'] = ('time', times, time_atts)
+
+    dset_out = xarray.Dataset(d)
+    for var in var_list:
+        dset_out[var].attrs = var_atts[var]
+
+    gio.set_global_atts(dset_out, global_atts, outfile_metadata)
+    dset_out.to_netcdf(outfile, format='NETCDF3_CLASSIC')
+
+
+def main(inargs):
+    """Run the program."""
+
+    # Read the data
+    dset_in = xarray.open_dataset(inargs.infile)
+    var_list = inargs.variables if inargs.variables else get_variables(dset_in)
+    subset_dict = gio.get_subset_kwargs(inargs)
+
+    # Set up the anomaly calculation (the climatology is calculated here)
+    darrays = []
+    slab_generators = []
+    anomaly_atts = {}
+    for var in var_list:
+        darray = dset_in[var].sel(**subset_dict)
+        slabs, times = calc_anomaly(darray, inargs.chunk_size, runmean_window=inargs.runmean)
+        darrays.append(darray)
+        slab_generators.append(slabs)
+
+        anomaly_atts[var] = darray.attrs.copy()
+        notes = 'Anomaly with respect to the daily climatology (cdo ydaysub/ydayavg equivalent).'
+        if inargs.runmean:
+            notes = notes + ' %i time step centred running mean applied (cdo runmean equivalent).' %(inargs.runmean)
+        anomaly_atts[var]['notes'] = notes
+
+    time_atts = dset_in['time'].attrs.copy()
+    time_atts.pop('bounds', None)
+    outfile_metadata = {inargs.infile: dset_in.attrs['history'],}
+
+    # Write each slab to a temporary file and then combine them
+    temp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(inargs.outfile)))
+    try:
+        temp_files = []
+        start = 0
+        for slab_num, slabs in enumerate(itertools.izip(*slab_generators)):
+            nsteps = slabs[0].shape[0]
+            if not nsteps:
+                continue
+            temp_file = os.path.join(temp_dir, 'slab%i.nc' %(slab_num))
+            write_slab(temp_file, var_list, darrays, slabs, times[start:start + nsteps], 
+                       time_atts, anomaly_atts, dset_in.attrs, outfile_metadata)
+            temp_files.append(temp_file)
+            start = start + nsteps
+
+        dset_out = xarray.open_mfdataset(temp_files)
+        dset_out.to_netcdf(inargs.outfile, format='NETCDF3_CLASSIC')
+        dset_out.close()
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+
+    extra_info = """
+example:
+  python calc_daily_anomaly.py sf_ERAInterim_500hPa_daily_native.nc
+  sf_ERAInterim_500hPa_030day-runmean-anom-wrt-all_native.nc --runmean 30
+
+  is equivalent to cdo runmean,30 -ydaysub infile -ydayavg infile outfile
+  followed by fix_time_bounds.sh (i.e. the output has no time bounds)
+
+note:
+  The data are streamed through --chunk_size time steps at a time (once
+  to calculate the climatology and once to calculate the anomaly). Each 
+  anomaly slab is written to a temporary file (in the output directory) 
+  and the slabs are then combined into the output file. Leap days are 
+  treated as in cdo (i.e. the 29th of February has its own climatology).
+
+author:
+  Damien Irving, d.irving@student.unimelb.edu.au
+
+"""
+
+    description = 'Calculate the anomaly with respect to the daily climatology (and optionally a running mean)'
+    parser = argparse.ArgumentParser(description=description,
+                                     epilog=extra_info,
+                                     argument_default=argparse.SUPPRESS,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument("infile", type=str, help="Input file name")
+    parser.add_argument("outfile", type=str, help="Output file name")
+
+    parser.add_argument("--variables", type=str, nargs='*', default=None,
+                        help="Variables to process [default = all variables with a time axis]")
+    parser.add_argument("--runmean", type=int, default=None,
+                        help="Window for a centred running mean, applied to the anomaly [default = None]")
+
+    parser.add_argument("--time", type=str, nargs=2, metavar=('START_DATE', 'END_DATE'),
+                        help="Time period [default = entire]")
+    parser.add_argument("--chunk_size", type=int, default=365,
+                        help="Number of time steps to read at once [default = 365]")
+
+    args = parser.parse_args()
+
+    print 'Input file: ', args.infile
+    print 'Output file: ', args.outfile
+
+    main(args)
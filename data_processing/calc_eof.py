@@ -10,7 +10,10 @@ Reference:    Uses eofs package: http://ajdawson.github.io/eofs/
 
 import sys, os, pdb
 import argparse
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
 import numpy, xray
+from scipy.sparse.linalg import svds
 import eofs
 import iris
 
@@ -38,6 +41,13 @@ season_constraints = {'DJF': iris.Constraint(time=lambda t: t in [iris.time.Part
                       'JJA': iris.Constraint(time=lambda t: iris.time.PartialDateTime(month=6) <= t <= iris.time.PartialDateTime(month=8)),
                       'SON': iris.Constraint(time=lambda t: iris.time.PartialDateTime(month=9) <= t <= iris.time.PartialDateTime(month=11))}
 
+season_months = {'annual': None, 'DJF': (12, 1, 2), 'MAM': (3, 4, 5), 'JJA': (6, 7, 8), 'SON': (9, 10, 11)}
+season_order = ['annual', 'DJF', 'MAM', 'JJA', 'SON']
+
+_shared_cube = None  # Set before the worker pool is forked so each season solve reuses one load
+_shared_matrix = None  # Weighted data matrix used by the Monte Carlo workers
+_shared_ref_eofs = None
+
 class EofAnalysis:
     """Perform an EOF analysis. 
     
@@ -52,6 +62,67 @@ class EofAnalysis:
         self.solver = eofs.iris.Eof(cube, weights='coslat')
         self.var_exp = self.solver.varianceFraction(neigs=neofs)
         self.north_test = self.solver.northTest(neigs=neofs, vfscaled=True)
+        self.mc_atts = [{} for i in range(0, neofs)]
+
+
+    def monte_carlo_test(self, cube, nresamples=200, block_size=30, workers=1, seed=None):
+        """Moving block bootstrap test of the eigenvalues and EOF patterns.
+
+        Unlike the North et al. (1982) test, resampling blocks of block_size
+        consecutive time steps retains the autocorrelation of the data. 
+        Each resample is centred and a truncated SVD (first neofs modes only) 
+        is performed. The weighted data matrix is placed in shared memory once
+        and the resamples are spread across a pool of worker processes.
+
+        """
+
+        ntime = cube.shape[0]
+        assert block_size < ntime, "Block size must be less than the number of time steps"
+
+        data = numpy.ma.filled(cube.data, numpy.nan).reshape(ntime, -1)
+        ref_eofs = numpy.ma.filled(self.solver.eofs(neofs=self.neofs, eofscaling=0).data, numpy.nan)
+        ref_eofs = ref_eofs.reshape(self.neofs, -1)
+        valid = ~numpy.isnan(ref_eofs[0])  # missing values are NaN in every EOF
+        weights = self.solver.getWeights().flatten()[valid]
+
+        shared = RawArray('d', ntime * int(valid.sum()))
+        matrix = numpy.frombuffer(shared).reshape(ntime, -1)
+        matrix[:] = data[:, valid]
+        matrix -= matrix.mean(axis=0)
+        matrix *= weights
+        del data
+
+        # Split the resamples into one batch per worker, each with its own seed
+        nbatches = max(workers, 1)
+        batch_sizes = [len(batch) for batch in numpy.array_split(numpy.arange(nresamples), nbatches)]
+        seeds = numpy.random.RandomState(seed).randint(0, 2**31 - 1, nbatches)
+        tasks = [(seeds[i], batch_sizes[i], block_size, self.neofs) for i in range(nbatches) if batch_sizes[i]]
+
+        initargs = (shared, matrix.shape, ref_eofs[:, valid])
+        if workers > 1:
+            pool = multiprocessing.Pool(workers, initializer=_init_bootstrap, initargs=initargs)
+            results = pool.map(_bootstrap_batch, tasks)
+            pool.close()
+            pool.join()
+        else:
+            _init_bootstrap(*initargs)
+            results = map(_bootstrap_batch, tasks)
+
+        var_exp = numpy.concatenate([result[0] for result in results])
+        congruence = numpy.concatenate([result[1] for result in results])
+        best_match = numpy.concatenate([result[2] for result in results])
+
+        lower, upper = numpy.percentile(var_exp, [2.5, 97.5], axis=0)
+        notes = 'Moving block bootstrap: %i resamples, block size %i time steps' %(nresamples, block_size)
+        for i in range(0, self.neofs):
+            # There is no next EOF to compare the last one with
+            separated = int(lower[i] > upper[i + 1]) if i < self.neofs - 1 else -1
+            self.mc_atts[i] = {'mc_var_exp_lower': float(lower[i]),
+                               'mc_var_exp_upper': float(upper[i]),
+                               'mc_separated_from_next': separated,
+                               'mc_pattern_congruence': float(numpy.median(congruence[:, i])),
+                               'mc_mode_stability': float((best_match[:, i] == i).mean()),
+                               'mc_notes': notes}
 
 
     def eof(self, eof_scaling=0):
@@ -83,6 +154,7 @@ class EofAnalysis:
                                             'north_error': float(self.north_test[i].data),
                                             'reference': 'http://ajdawson.github.io/eofs/',
                                             'notes': eof_scaling_text}
+            attributes['eof'+str(i + 1)].update(self.mc_atts[i])
   
         return eofs, attributes
      
@@ -111,14 +183,279 @@ class EofAnalysis:
                                            'north_error': float(self.north_test[i].data),
                                            'reference': 'http://ajdawson.github.io/eofs/',
                                            'notes': pc_scaling_text}
+            attributes['pc'+str(i + 1)].update(self.mc_atts[i])
 
         return pcs, attributes 
- 
 
-def main(inargs):
-    """Run the program."""
-    
-    # Prepate input data
+
+    def write_state(self, cube, outfile):
+        """Write the solver state to file so new data can be projected onto the EOFs.
+
+        The unscaled EOFs, eigenvalues, weights and time mean are everything
+        needed to reproduce solver.projectField() without solving again. 
+
+        """
+
+        time_coord = cube.coord('time')
+        lat_coord = cube.coord('latitude')
+        lon_coord = cube.coord('longitude')
+
+        eofs = self.solver.eofs(neofs=self.neofs, eofscaling=0).data
+        eigenvalues = self.solver.eigenvalues(neigs=self.neofs).data
+        weights = self.solver.getWeights()
+        time_mean = numpy.ma.filled(cube.data.mean(axis=0), numpy.nan)
+
+        d = {}
+        d['eof_number'] = ('eof_number', numpy.arange(1, self.neofs + 1))
+        d['latitude'] = ('latitude', lat_coord.points)
+        d['longitude'] = ('longitude', lon_coord.points)
+        d['eofs'] = (['eof_number', 'latitude', 'longitude'], numpy.ma.filled(eofs, numpy.nan))
+        d['eigenvalues'] = (['eof_number'], eigenvalues)
+        d['weights'] = (['latitude', 'longitude'], weights)
+        d['time_mean'] = (['latitude', 'longitude'], time_mean)
+
+        dset_out = xray.Dataset(d)
+        dset_out['eofs'].attrs = {'long_name': 'empirical_orthogonal_functions',
+                                  'units': '',
+                                  'notes': 'No scaling applied'}
+        dset_out['eigenvalues'].attrs = {'long_name': 'eigenvalues',
+                                         'units': ''}
+        dset_out['weights'].attrs = {'long_name': 'eof_weights',
+                                     'units': '',
+                                     'notes': 'sqrt(cos(latitude)) weights applied to the input data'}
+        dset_out['time_mean'].attrs = {'long_name': 'time_mean',
+                                       'units': str(cube.units),
+                                       'notes': 'Time mean removed from the input data prior to the analysis'}
+        dset_out['latitude'].attrs = {'standard_name': 'latitude', 'long_name': 'latitude',
+                                      'units': 'degrees_north', 'axis': 'Y'}
+        dset_out['longitude'].attrs = {'standard_name': 'longitude', 'long_name': 'longitude',
+                                       'units': 'degrees_east', 'axis': 'X'}
+
+        outfile_metadata = {'input data': cube.attributes['history']}
+        gio.set_global_atts(dset_out, cube.attributes.copy(), outfile_metadata)
+        dset_out.attrs['time_period'] = '%s to %s' %(str(time_coord.units.num2date(time_coord.points[0])),
+                                                     str(time_coord.units.num2date(time_coord.points[-1])))
+        dset_out.to_netcdf(outfile)
+
+
+def _init_bootstrap(shared, shape, ref_eofs):
+    """Attach a worker process to the shared weighted data matrix."""
+
+    global _shared_matrix, _shared_ref_eofs
+
+    _shared_matrix = numpy.frombuffer(shared).reshape(shape)
+    _shared_ref_eofs = ref_eofs
+
+
+def _bootstrap_batch(args):
+    """Perform a batch of moving block bootstrap resamples.
+
+    Returns the variance fraction of each mode, the congruence 
+    (absolute pattern correlation) of each resampled EOF with the 
+    corresponding reference EOF and the index of the reference EOF
+    each resampled EOF best matches.
+
+    """
+
+    seed, nsamples, block_size, neofs = args
+
+    state = numpy.random.RandomState(seed)
+    ntime = _shared_matrix.shape[0]
+    nblocks = int(numpy.ceil(ntime / float(block_size)))
+    block_offsets = numpy.arange(block_size)
+
+    var_exp = numpy.zeros([nsamples, neofs])
+    congruence = numpy.zeros([nsamples, neofs])
+    best_match = numpy.zeros([nsamples, neofs], dtype=int)
+    for sample in xrange(nsamples):
+        starts = state.randint(0, ntime - block_size + 1, nblocks)
+        indexes = (starts[:, numpy.newaxis] + block_offsets).flatten()[0:ntime]
+
+        resample = _shared_matrix[indexes, :]
+        resample -= resample.mean(axis=0)
+
+        u, svals, vt = svds(resample, k=neofs)
+        order = numpy.argsort(svals)[::-1]  # svds returns ascending singular values
+        svals = svals[order]
+        vt = vt[order, :]
+
+        similarity = numpy.abs(numpy.dot(vt, _shared_ref_eofs.T))
+        var_exp[sample, :] = svals**2 / (resample**2).sum()
+        congruence[sample, :] = similarity.diagonal()
+        best_match[sample, :] = similarity.argmax(axis=1)
+
+    return var_exp, congruence, best_match
+
+
+def project_field(cube, state_file, pc_scaling=0, chunk_size=1000):
+    """Project new data onto the EOFs stored in a solver state file.
+
+    Equivalent to eofs projectField(): the stored time mean is removed, 
+    the stored weights applied and the result multiplied by the EOFs.
+    The time axis is processed in chunks so only one slab is ever in memory. 
+
+    """
+
+    dset_state = xray.open_dataset(state_file)
+
+    lat_values = cube.coord('latitude').points
+    lon_values = cube.coord('longitude').points
+    assert numpy.allclose(lat_values, dset_state['latitude'].values), \
+    "Latitude axis must match the stored solver (check --maxlat)"
+    assert numpy.allclose(lon_values, dset_state['longitude'].values), \
+    "Longitude axis must match the stored solver"
+
+    neofs = dset_state['eof_number'].shape[0]
+    eofs_flat = dset_state['eofs'].values.reshape(neofs, -1)
+    valid = ~numpy.isnan(eofs_flat[0])  # missing values are NaN in every EOF
+    eofs_valid = eofs_flat[:, valid]
+
+    time_mean = dset_state['time_mean'].values.flatten()[valid]
+    weights = dset_state['weights'].values.flatten()[valid]
+
+    ntime = cube.shape[0]
+    pcs = numpy.zeros([ntime, neofs])
+    for start in xrange(0, ntime, chunk_size):
+        end = min(start + chunk_size, ntime)
+        data = cube[start:end].data.reshape(end - start, -1)[:, valid]
+        pcs[start:end, :] = numpy.dot((data - time_mean) * weights, eofs_valid.T)
+
+    eigenvalues = dset_state['eigenvalues'].values
+    if pc_scaling == 0:
+        pc_scaling_text = 'No scaling applied'
+    elif pc_scaling == 1:
+        pcs = pcs / numpy.sqrt(eigenvalues)
+        pc_scaling_text = 'PC scaled by the square-root of the solver eigenvalue'
+    elif pc_scaling == 2:
+        pcs = pcs * numpy.sqrt(eigenvalues)
+        pc_scaling_text = 'PC multiplied by the square-root of the solver eigenvalue'
+    else:
+        print 'PC scaling method not recongnised'
+        sys.exit(1)
+
+    attributes = {}
+    for i in range(0, neofs):
+        attributes['pc'+str(i + 1)] = {'long_name': 'pseudo_principle_component_'+str(i + 1),
+                                       'standard_name': 'pseudo_principle_component_'+str(i + 1),
+                                       'units': '',
+                                       'reference': 'http://ajdawson.github.io/eofs/',
+                                       'notes': 'Projection onto stored EOF '+str(i + 1)+'. '+pc_scaling_text}
+
+    return pcs, attributes, dset_state.attrs['history']
+
+
+def get_season_indexes(cube):
+    """Get the time axis indexes corresponding to each season."""
+
+    time_coord = cube.coord('time')
+    months = numpy.array([dt.month for dt in time_coord.units.num2date(time_coord.points)])
+
+    season_indexes = {}
+    for season, months_in_season in season_months.iteritems():
+        if months_in_season:
+            season_indexes[season] = numpy.where(numpy.in1d(months, months_in_season))[0]
+        else:
+            season_indexes[season] = numpy.arange(len(months))
+
+    return season_indexes
+
+
+def _solve_season(args):
+    """Perform the EOF analysis for one season of the shared cube.
+
+    Only numpy arrays and attribute dictionaries are returned
+    so the result is cheap to send back from a worker process.
+
+    """
+
+    season, indexes, eof_kwargs, scaling_kwargs = args
+
+    eof_anal = EofAnalysis(_shared_cube[indexes], **eof_kwargs)
+    eof_cube, eof_atts = eof_anal.eof(**uconv.dict_filter(scaling_kwargs, uconv.list_kwargs(eof_anal.eof)))
+    pc_cube, pc_atts = eof_anal.pcs(**uconv.dict_filter(scaling_kwargs, uconv.list_kwargs(eof_anal.pcs)))
+
+    var_exp = numpy.array([float(value.data) for value in eof_anal.var_exp])
+    north_error = numpy.array([float(value.data) for value in eof_anal.north_test])
+
+    return season, eof_cube.data, pc_cube.data, var_exp, north_error, eof_atts, pc_atts
+
+
+def main_all_seasons(inargs, cube):
+    """Perform the EOF analysis for every season from a single load of the data."""
+
+    global _shared_cube
+
+    assert not inargs.solver_file, "--solver_file is not available with --season all"
+    assert not inargs.mc_resamples, "--mc_resamples is not available with --season all"
+
+    cube.data  # Realise the data once in the parent so the workers share it
+    _shared_cube = cube
+
+    season_indexes = get_season_indexes(cube)
+    eof_kwargs = uconv.dict_filter(vars(inargs), uconv.list_kwargs(EofAnalysis.__init__))
+    scaling_kwargs = uconv.dict_filter(vars(inargs), ['eof_scaling', 'pc_scaling'])
+    tasks = [(season, season_indexes[season], eof_kwargs, scaling_kwargs) for season in season_order]
+
+    if inargs.workers > 1:
+        pool = multiprocessing.Pool(min(inargs.workers, len(tasks)))
+        results = pool.map(_solve_season, tasks)
+        pool.close()
+        pool.join()
+    else:
+        results = map(_solve_season, tasks)
+
+    # Write output file (PCs are missing outside of their season)
+    time_coord = cube.coord('time')
+    lat_coord = cube.coord('latitude')
+    lon_coord = cube.coord('longitude')
+    nseasons = len(season_order)
+    ntime, nlat, nlon = cube.shape
+
+    eof_data = numpy.zeros([inargs.neofs, nseasons, nlat, nlon])
+    pc_data = numpy.ones([inargs.neofs, nseasons, ntime]) * numpy.nan
+    var_exp = numpy.zeros([nseasons, inargs.neofs])
+    north_error = numpy.zeros([nseasons, inargs.neofs])
+    for season, season_eofs, season_pcs, season_var_exp, season_north_error, eof_atts, pc_atts in results:
+        sindex = season_order.index(season)
+        eof_data[:, sindex, :, :] = numpy.ma.filled(season_eofs, numpy.nan)
+        pc_data[:, sindex, season_indexes[season]] = season_pcs.T
+        var_exp[sindex, :] = season_var_exp
+        north_error[sindex, :] = season_north_error
+
+    d = {}
+    d['season'] = ('season', season_order)
+    d['time'] = ('time', time_coord.points)
+    d['latitude'] = ('latitude', lat_coord.points)
+    d['longitude'] = ('longitude', lon_coord.points)
+    d['eof_number'] = ('eof_number', numpy.arange(1, inargs.neofs + 1))
+    d['var_exp'] = (['season', 'eof_number'], var_exp)
+    d['north_error'] = (['season', 'eof_number'], north_error)
+    for index in xrange(inargs.neofs):
+        d['eof' + str(index + 1)] = (['season', 'latitude', 'longitude'], eof_data[index, ...])
+        d['pc' + str(index + 1)] = (['season', 'time'], pc_data[index, ...])
+
+    dset_out = xray.Dataset(d)
+
+    for index in xrange(inargs.neofs):
+        eof_var = 'eof'+str(index + 1)
+        pc_var = 'pc'+str(index + 1)
+        dset_out[eof_var].attrs = uconv.dict_filter(eof_atts[eof_var], ['long_name', 'standard_name', 'units', 'reference', 'notes'])
+        dset_out[pc_var].attrs = uconv.dict_filter(pc_atts[pc_var], ['long_name', 'standard_name', 'units', 'reference', 'notes'])
+    dset_out['var_exp'].attrs = {'long_name': 'variance_fraction_explained', 'units': ''}
+    dset_out['north_error'].attrs = {'long_name': 'north_test_typical_error', 'units': '',
+                                     'notes': 'Scaled by the sum of the eigenvalues'}
+
+    gio.set_dim_atts(dset_out, str(time_coord.units))
+
+    outfile_metadata = {inargs.infile: cube.attributes['history']}
+
+    gio.set_global_atts(dset_out, cube.attributes, outfile_metadata)
+    dset_out.to_netcdf(inargs.outfile,)
+
+
+def read_data(inargs):
+    """Read the input data, applying the time, season and latitude constraints."""
+
     try:
         time_constraint = gio.get_time_constraint(inargs.time)
     except AttributeError:
@@ -131,7 +468,7 @@ def main(inargs):
 
     try:
         season_constraint = season_constraints[inargs.season]
-    except AttributeError:
+    except (AttributeError, KeyError):  # no season or 'all'
         season_constraint = iris.Constraint()
 
     with iris.FUTURE.context(cell_datetime_objects=True):
@@ -139,13 +476,58 @@ def main(inargs):
 
     coord_names = [coord.name() for coord in cube.coords()]
     assert coord_names == ['time', 'latitude', 'longitude']
+
+    return cube
+
+
+def main_project(inargs, cube):
+    """Project the input data onto a stored solver and write the pseudo-PCs."""
+
+    time_coord = cube.coord('time')
+    pcs, pc_atts, state_history = project_field(cube, inargs.project, **uconv.dict_filter(vars(inargs), ['pc_scaling']))
+
+    d = {}
+    d['time'] = ('time', time_coord.points)
+    for index in xrange(pcs.shape[1]):
+        d['pc' + str(index + 1)] = (['time'], pcs[:, index])
+
+    dset_out = xray.Dataset(d)
+    for index in xrange(pcs.shape[1]):
+        pc_var = 'pc'+str(index + 1)
+        dset_out[pc_var].attrs = pc_atts[pc_var]
+
+    dset_out['time'].attrs = {'calendar': 'standard', 
+                              'long_name': 'time',
+                              'units': str(time_coord.units),
+                              'axis': 'T'}
+
+    outfile_metadata = {inargs.infile: cube.attributes['history'],
+                        inargs.project: state_history}
+
+    gio.set_global_atts(dset_out, cube.attributes, outfile_metadata)
+    dset_out.to_netcdf(inargs.outfile,)
+
+
+def main(inargs):
+    """Run the program."""
     
+    cube = read_data(inargs)
+    if inargs.project:
+        main_project(inargs, cube)
+        return
+    elif vars(inargs).get('season') == 'all':
+        main_all_seasons(inargs, cube)
+        return
+
     time_coord = cube.coord('time')
     lat_coord = cube.coord('latitude')
     lon_coord = cube.coord('longitude')
     
     # Perform EOF analysis
     eof_anal = EofAnalysis(cube, **uconv.dict_filter(vars(inargs), uconv.list_kwargs(EofAnalysis.__init__)))
+    if inargs.mc_resamples:
+        eof_anal.monte_carlo_test(cube, nresamples=inargs.mc_resamples, block_size=inargs.mc_block_size, 
+                                  workers=inargs.workers)
     
     eof_cube, eof_atts = eof_anal.eof(**uconv.dict_filter(vars(inargs), uconv.list_kwargs(eof_anal.eof)))
     pc_cube, pc_atts = eof_anal.pcs(**uconv.dict_filter(vars(inargs), uconv.list_kwargs(eof_anal.pcs)))
@@ -177,6 +559,9 @@ def main(inargs):
     gio.set_global_atts(dset_out, cube.attributes, outfile_metadata)
     dset_out.to_netcdf(inargs.outfile,) #format='NETCDF3_CLASSIC')
 
+    if inargs.solver_file:
+        eof_anal.write_state(cube, inargs.solver_file)
+
 
 if __name__ == '__main__':
 
@@ -197,6 +582,10 @@ reference:
 
 example:
 
+  Save the solver state and then project new data onto the stored EOFs:
+    python calc_eof.py --maxlat 0.0 --solver_file eof-solver.nc infile.nc streamfunction eof.nc 
+    python calc_eof.py --maxlat 0.0 --project eof-solver.nc --pc_scaling 1 newfile.nc streamfunction pseudo-pcs.nc
+
 notes:
   The data are area weighted according the the sqrt of the cosine of the latitude, as 
   recommended by Wilks2011
@@ -209,6 +598,28 @@ notes:
   It is assumed that the number of times in the input data set is the same as the number of independent realizations.
   If this assumption is not valid then the result may be inappropriate.
 
+  With --season all the data are read once and split into annual, DJF, MAM, JJA and SON 
+  subsets. The five analyses are run in parallel (see --workers) and written to one file
+  with a season dimension. The PCs are given on the full time axis (missing outside the season) 
+  and the variance explained and north error are written as variables.
+
+  The --mc_resamples option performs a moving block bootstrap that (unlike the North test) 
+  allows for autocorrelated data such as running mean daily data. Blocks of --mc_block_size 
+  consecutive time steps are resampled, a truncated SVD is performed on each resample and the
+  following attributes are added to each EOF/PC:
+    mc_var_exp_lower/upper  -- 95% confidence interval for the variance explained
+    mc_separated_from_next  -- 1 if the interval does not overlap that of the next EOF, 
+                               0 if it does (-1 for the last EOF, which has no next EOF)
+    mc_pattern_congruence   -- median absolute pattern correlation with the original EOF
+    mc_mode_stability       -- fraction of resamples in which the mode best matches the original EOF
+  The block size should be at least as long as the autocorrelation timescale 
+  (e.g. the running mean window).
+
+  In --project mode no EOF analysis is performed. The input data (subject to the same
+  --time, --season and --maxlat constraints) are centred with the stored time mean, 
+  weighted and projected onto the stored EOFs to give pseudo-PCs. For pc_scaling 1 and 2 
+  the eigenvalues of the stored solver are used.
+
 author:
   Damien Irving, d.irving@student.unimelb.edu.au
 
@@ -226,8 +637,8 @@ author:
             
     parser.add_argument("--time", type=str, nargs=2, metavar=('START_DATE', 'END_DATE'),
                         help="Time period over which to calculate the EOF [default = entire]")
-    parser.add_argument("--season", type=str, choices=['DJF', 'MAM', 'JJA', 'SON'],
-                        help="Restrict analysis to a particular season [default = annual]")
+    parser.add_argument("--season", type=str, choices=['DJF', 'MAM', 'JJA', 'SON', 'all'],
+                        help="Restrict analysis to a particular season, or do every season [default = annual]")
 
     parser.add_argument("--neofs", type=int, default=5,
                         help="Number of EOFs for output [default=5]")
@@ -237,6 +648,17 @@ author:
                         help="Scaling method applied to EOF post calculation [default = None]")
     parser.add_argument("--pc_scaling", type=int, choices=[0, 1, 2],
                         help="Scaling method applied to EOF post calculation [default = None]")
+
+    parser.add_argument("--solver_file", type=str, default=None,
+                        help="Also write the solver state (EOFs, eigenvalues, weights, mean) to this file [default = None]")
+    parser.add_argument("--project", type=str, default=None, metavar='SOLVER_FILE',
+                        help="Project the input data onto the EOFs in this solver state file instead of solving [default = None]")
+    parser.add_argument("--mc_resamples", type=int, default=0,
+                        help="Number of block bootstrap resamples for the Monte Carlo significance test [default = 0 (no test)]")
+    parser.add_argument("--mc_block_size", type=int, default=30,
+                        help="Number of consecutive time steps in each bootstrap block [default = 30]")
+    parser.add_argument("--workers", type=int, default=len(season_order),
+                        help="Number of parallel processes used with --season all or --mc_resamples [default = 5]")
     
     args = parser.parse_args()            
 
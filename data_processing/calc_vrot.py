@@ -8,9 +8,9 @@ Description:  Calculate the meridional wind for a rotated coordinate system
 # Import general Python modules
 
 import sys, os, re, pdb
-import argparse
+import argparse, hashlib
 import numpy, math
-import scipy.interpolate
+import scipy.sparse
 import xray
 import iris
 
@@ -49,24 +49,137 @@ def clean_data(cube, max_value, min_value):
     return data_clean
 
 
-def make_grid(lat_values, lon_values, np_lat, np_lon):
-    """Make a dummy cube with desired grid."""
-    
-    coordsys = iris.coord_systems.RotatedGeogCS(np_lat, np_lon)
-    
-    latitude = iris.coords.DimCoord(lat_values,
-                                    standard_name='latitude',
-                                    units='degrees_north',
-                                    coord_system=coordsys)
-    longitude = iris.coords.DimCoord(lon_values,                     
-                                     standard_name='longitude',
-                                     units='degrees_east',
-                                     coord_system=coordsys)
-
-    dummy_data = numpy.zeros((len(lat_values), len(lon_values)))
-    new_cube = iris.cube.Cube(dummy_data, dim_coords_and_dims=[(latitude, 0), (longitude, 1)])
-    
-    return new_cube
+def bilinear_weights(src_lats, src_lons, target_lats, target_lons):
+    """Bilinear interpolation weights from a global lat/lon grid to a set of points.
+
+    Args:
+      src_lats (numpy.ndarray): Source latitude axis (ascending or descending)
+      src_lons (numpy.ndarray): Source longitude axis (evenly spaced, global)
+      target_lats (numpy.ndarray): Latitude of each target point (flattened)
+      target_lons (numpy.ndarray): Longitude of each target point (flattened)
+
+    Returns:
+      A scipy.sparse.csr_matrix of shape (ntarget, nlat * nlon), so that 
+        regridded = weights * data.flatten()
+
+    Design:
+      Longitude is treated as circular. Latitudes beyond the outer grid 
+        rows are linearly extrapolated (like iris.analysis.Linear).
+
+    """
+
+    nlat = len(src_lats)
+    nlon = len(src_lons)
+    dlon = 360.0 / nlon
+    assert numpy.allclose(numpy.diff(src_lons) % 360, dlon), "Source longitudes must be evenly spaced and global"
+
+    lat_order = numpy.argsort(src_lats)
+    sorted_lats = src_lats[lat_order]
+    lat_index = numpy.clip(numpy.searchsorted(sorted_lats, target_lats) - 1, 0, nlat - 2)
+    lat_frac = (target_lats - sorted_lats[lat_index]) / (sorted_lats[lat_index + 1] - sorted_lats[lat_index])
+
+    lon_position = ((target_lons - src_lons[0]) % 360) / dlon
+    lon_index = numpy.floor(lon_position).astype(int) % nlon
+    lon_frac = lon_position - numpy.floor(lon_position)
+
+    rows = numpy.repeat(numpy.arange(len(target_lats)), 4)
+    lat0 = lat_order[lat_index]
+    lat1 = lat_order[lat_index + 1]
+    lon0 = lon_index
+    lon1 = (lon_index + 1) % nlon
+    cols = numpy.column_stack([lat0 * nlon + lon0, lat0 * nlon + lon1,
+                               lat1 * nlon + lon0, lat1 * nlon + lon1]).flatten()
+    weights = numpy.column_stack([(1 - lat_frac) * (1 - lon_frac), (1 - lat_frac) * lon_frac,
+                                  lat_frac * (1 - lon_frac), lat_frac * lon_frac]).flatten()
+
+    return scipy.sparse.csr_matrix((weights, (rows, cols)), shape=(len(target_lats), nlat * nlon))
+
+
+def get_regrid_weights(lat_values, lon_values, np_lat, np_lon, weights_dir):
+    """Get the weights for regridding to the rotated grid.
+
+    The target grid has the same latitude and longitude values as the 
+    source grid, but defined on the rotated coordinate system (with 
+    the north pole at np_lat, np_lon). 
+
+    The weights depend only on the source grid and the pole, so they are 
+    saved to (and subsequently read from) a file in weights_dir whose 
+    name is a hash of the grid and pole.
+
+    """
+
+    key = hashlib.md5()
+    for values in [lat_values, lon_values, numpy.array([np_lat, np_lon])]:
+        key.update(numpy.ascontiguousarray(values, dtype=numpy.float64).tostring())
+    weights_file = os.path.join(weights_dir, 'vrot-regrid-weights_%s.npz' %(key.hexdigest()))
+
+    if os.path.isfile(weights_file):
+        stored = numpy.load(weights_file)
+        weights = scipy.sparse.csr_matrix((stored['data'], stored['indices'], stored['indptr']),
+                                          shape=tuple(stored['shape']))
+    else:
+        rotated_lons, rotated_lats = numpy.meshgrid(lon_values, lat_values)
+        true_lons, true_lats = iris.analysis.cartography.unrotate_pole(rotated_lons, rotated_lats, np_lon, np_lat)
+        weights = bilinear_weights(lat_values, lon_values, true_lats.flatten(), true_lons.flatten())
+        numpy.savez(weights_file, data=weights.data, indices=weights.indices, 
+                    indptr=weights.indptr, shape=weights.shape)
+
+    return weights
+
+
+def pole_bearing(lat_values, lon_values, np_lat, np_lon):
+    """Sine and cosine of the bearing from each grid point to the rotated north pole.
+
+    The bearing is the angle (clockwise from true north) between the true 
+    and rotated north directions, which is all that is needed to rotate
+    the wind vectors. Returns two (lat, lon) arrays.
+
+    """
+
+    deg2rad = numpy.pi / 180.0
+    lats, lons = numpy.meshgrid(lat_values * deg2rad, lon_values * deg2rad, indexing='ij')
+    pole_lat = np_lat * deg2rad
+    dlon = np_lon * deg2rad - lons
+
+    bearing = numpy.arctan2(numpy.sin(dlon) * numpy.cos(pole_lat),
+                            numpy.cos(lats) * numpy.sin(pole_lat) - numpy.sin(lats) * numpy.cos(pole_lat) * numpy.cos(dlon))
+
+    return numpy.sin(bearing), numpy.cos(bearing)
+
+
+def calc_vrot(u_cube, v_cube, np_lat, np_lon, weights, chunk_size=365):
+    """Calculate the rotated meridional wind on the rotated grid.
+
+    Only the rotated meridional component is calculated 
+    (vrot = u sin(bearing) + v cos(bearing), where the bearing
+    is to the rotated north pole), one chunk of time steps at a time, 
+    and each chunk is then regridded to the rotated grid. The regridded 
+    output for every time step is held in memory (hence calc_vrot.sh 
+    processes a few years at a time).
+
+    Args:
+      u_cube (iris.cube.Cube): Zonal wind (time, latitude, longitude)
+      v_cube (iris.cube.Cube): Meridional wind
+      np_lat (float): Latitude of the rotated north pole
+      np_lon (float): Longitude of the rotated north pole
+      weights (scipy.sparse.csr_matrix): Regridding weights from get_regrid_weights
+      chunk_size (int): Number of time steps to process at once
+
+    """
+
+    sin_bearing, cos_bearing = pole_bearing(v_cube.coord('latitude').points, 
+                                            v_cube.coord('longitude').points,
+                                            np_lat, np_lon)
+
+    ntime = v_cube.shape[0]
+    vrot_regridded = numpy.zeros((ntime, weights.shape[0]))
+    for start in xrange(0, ntime, chunk_size):
+        end = min(start + chunk_size, ntime)
+        vrot = numpy.multiply(u_cube[start:end].data, sin_bearing)
+        vrot += v_cube[start:end].data * cos_bearing
+        vrot_regridded[start:end, :] = weights.dot(vrot.reshape(end - start, -1).T).T
+
+    return vrot_regridded.reshape(v_cube.shape)
 
 
 def main(inargs):
@@ -90,17 +203,11 @@ def main(inargs):
     lat_coord = v_cube.coord('latitude')
     lon_coord = v_cube.coord('longitude')
 
-    # Rotate wind
+    # Rotate wind and regrid
     np_lat, np_lon = inargs.north_pole
-    rotated_cs = iris.coord_systems.RotatedGeogCS(np_lat, np_lon)
-    urot_cube, vrot_cube = iris.analysis.cartography.rotate_winds(u_cube, v_cube, rotated_cs)
-
-    # Regrid
-    target_grid_cube = make_grid(lat_coord.points, lon_coord.points, np_lat, np_lon)
-    scheme = iris.analysis.Linear()
-    vrot_cube.coords('latitude')[0].coord_system = iris.coord_systems.GeogCS(iris.fileformats.pp.EARTH_RADIUS)
-    vrot_cube.coords('longitude')[0].coord_system = iris.coord_systems.GeogCS(iris.fileformats.pp.EARTH_RADIUS)
-    vrot_regridded = vrot_cube.regrid(target_grid_cube, scheme)
+    weights_dir = inargs.weights_dir if inargs.weights_dir else os.path.dirname(os.path.abspath(inargs.outfile))
+    weights = get_regrid_weights(lat_coord.points, lon_coord.points, np_lat, np_lon, weights_dir)
+    vrot_regridded = calc_vrot(u_cube, v_cube, np_lat, np_lon, weights, chunk_size=inargs.chunk_size)
     #could use clean_data here to remove spurious large values that regirdding produces
 
     # Write to file
@@ -108,7 +215,7 @@ def main(inargs):
     d['time'] = ('time', time_coord.points)
     d['latitude'] = ('latitude', lat_coord.points)
     d['longitude'] = ('longitude', lon_coord.points)
-    d['vrot'] = (['time', 'latitude', 'longitude'], vrot_regridded.data)
+    d['vrot'] = (['time', 'latitude', 'longitude'], vrot_regridded)
 
     dset_out = xray.Dataset(d)
     dset_out['vrot'].attrs =  {'standard_name': 'rotated_northward_wind',
@@ -152,5 +259,10 @@ author:
     parser.add_argument("--time", type=str, nargs=2, metavar=('START_DATE', 'END_DATE'),
                         help="Time period [default = entire]")
 
+    parser.add_argument("--weights_dir", type=str, default=None,
+                        help="Directory for storing/reusing the regridding weights for a given grid and north pole [default = output file directory]")
+    parser.add_argument("--chunk_size", type=int, default=365,
+                        help="Number of time steps to rotate and regrid at once [default = 365]")
+
     args = parser.parse_args()            
     main(args)
@@ -53,7 +53,7 @@ for year in "${years[@]}"; do
     end=`expr $year + 2`
     temp_file=${temp_dir}/temp-vrot_${year}-${end}.nc
     ${python_exe} ${code_dir}/calc_vrot.py $ufile $ulong $vfile $vlong ${temp_file} \
-    --time ${year}-01-01 ${end}-12-31 --north_pole ${nplat} ${nplon} 
+    --time ${year}-01-01 ${end}-12-31 --north_pole ${nplat} ${nplon} --weights_dir ${temp_dir}
     temp_files+=(${temp_file})
 done
 
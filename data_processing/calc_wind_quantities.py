@@ -8,11 +8,15 @@ Reference:    Uses the windspharm package: ajdawson.github.com/windspharm/index.
 
 # Import general Python modules
 
-import sys, os, pdb
-import argparse
-import numpy, xray
+import sys, os, pdb, re
+import argparse, tempfile, shutil
+import math
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+import numpy, pandas, xray
 from windspharm.standard import VectorWind
 from windspharm.tools import prep_data, recover_data, order_latdim
+from spharm import Spharmt, gaussian_lats_wts, regrid
 
 # Import my modules
 
@@ -91,16 +95,45 @@ var_atts = {'spd': {'standard_name': 'wind_speed',
         'notes': 'Rossby wave source, advection of absolute vorticity by divergent flow term'}}
 
 
-def calc_quantity(uwnd, vwnd, quantity, lat_axis, lon_axis, axis_order):
-    """Calculate a single wind quantity.
+quantity_vars = {'magnitude': ['spd'],
+                 'vorticity': ['vrt'],
+                 'divergence': ['div'],
+                 'absolutevorticity': ['avrt'],
+                 'absolutevorticitygradient': ['avrtgrad'],
+                 'planetaryvorticity': ['pvrt'],
+                 'irrotationalcomponent': ['uchi', 'vchi'],
+                 'nondivergentcomponent': ['upsi', 'vpsi'],
+                 'streamfunction': ['sf'],
+                 'velocitypotential': ['vp'],
+                 'rossbywavesource': ['rws', 'rws1', 'rws2']}
+
+vector_vars = [('uchi', 'vchi'), ('upsi', 'vpsi')]  # (u, v) output variable pairs
+
+
+_shared_winds = None  # input winds, output arrays and settings shared with the worker processes
+_worker_wind = None   # VectorWind (and hence Spharmt setup) cached by each worker process
+_output_grids = {}    # Spharmt instances for Gaussian output grids (keys = number of latitudes)
+
+def calc_quantities(uwnd, vwnd, quantities, lat_axis, lon_axis, axis_order, w=None,
+                    truncation=None, output_nlat=None):
+    """Calculate one or more wind quantities.
 
     Args:
       uwnd (numpy.ndarray): Zonal wind
       vwnd (numpy.ndarray): Meridional wind
-      quantity (str): Quantity to be calculated
+      quantities (list): Quantities to be calculated
       lat_axis (list): Latitude axis values
       lon_axis (list): Longitude axis values
       axis_order (str): e.g. tyx
+      w (windspharm.standard.VectorWind, optional): Existing vector wind 
+        for the same grid (e.g. from the previous time slab), whose 
+        Spharmt grid setup is reused 
+      truncation (int, optional): Triangular truncation limit 
+      output_nlat (int, optional): Number of latitudes for a Gaussian 
+        output grid (e.g. 64 for T42) [default = input grid]
+
+    Returns:
+      The calculated data (dict) and the vector wind used
 
     Design:
       windsparm requires the input data to be on a global grid
@@ -110,6 +143,8 @@ def calc_quantity(uwnd, vwnd, quantity, lat_axis, lon_axis, axis_order):
         is supposed to adjust for these things but I've found that
         things come back upsidedown if the lat axis isn't right, so
         I've just used the standard interface here instead.
+
+      A single VectorWind instance is used for all the quantities.
        
     Reference: 
         ajdawson.github.io/windspharm
@@ -126,61 +161,282 @@ def calc_quantity(uwnd, vwnd, quantity, lat_axis, lon_axis, axis_order):
     lats, uwnd, vwnd = order_latdim(lat_axis, uwnd, vwnd)
     flip_lat = False if lats[0] == lat_axis[0] else True 
     
-    w = VectorWind(uwnd, vwnd)
+    if w is None:
+        w = VectorWind(uwnd, vwnd)
+    else:
+        set_winds(w, uwnd, vwnd)
+    data_out = wind_quantities(w, quantities, truncation=truncation)
+
+    # Regrid to the output grid
+    if output_nlat:
+        data_out = regrid_quantities(w, data_out, output_nlat, truncation=truncation)
+        uwnd_info = uwnd_info.copy()
+        uwnd_info['intermediate_shape'] = (output_nlat, 2 * output_nlat) + uwnd_info['intermediate_shape'][2:]
+
+    # Return data to its original shape
+    for key in data_out.keys():
+        data_out[key] = recover_structure(data_out[key], flip_lat, uwnd_info) 
+
+    return data_out, w
+
+
+def set_winds(w, uwnd, vwnd):
+    """Replace the wind components of an existing VectorWind instance.
+
+    Creating a VectorWind instance sets up a Spharmt instance (which 
+    holds the grid details and stored Legendre functions), so swapping 
+    in new winds on the same grid avoids repeating that setup.
+
+    """
+
+    assert uwnd.shape == vwnd.shape, "u and v must be the same shape"
+    assert uwnd.shape[0:2] == w.u.shape[0:2], "New winds must be on the same grid"
+    assert not (numpy.isnan(uwnd).any() or numpy.isnan(vwnd).any()), \
+    "u and v cannot contain missing values"
+
+    w.u = uwnd
+    w.v = vwnd
+
+
+def _init_wind_worker(shared_u, shared_v, shared_out, shape, out_shape, settings):
+    """Attach a worker process to the shared input and output arrays."""
+
+    global _shared_winds, _worker_wind
+
+    _shared_winds = {'u': numpy.frombuffer(shared_u).reshape(shape),
+                     'v': numpy.frombuffer(shared_v).reshape(shape),
+                     'out': dict((var, numpy.frombuffer(shared_out[var]).reshape(out_shape)) for var in shared_out.keys()),
+                     'settings': settings}
+    _worker_wind = None
+
+
+def _calc_slab(bounds):
+    """Calculate the wind quantities for one time slab of the shared data.
+
+    The results are written straight into the shared output arrays, 
+    so they are reassembled in time order regardless of which worker 
+    processes which slab.
+
+    """
+
+    global _worker_wind
+
+    start, end = bounds
+    data_out, _worker_wind = calc_quantities(_shared_winds['u'][start:end], _shared_winds['v'][start:end], 
+                                             w=_worker_wind, **_shared_winds['settings'])
+    for var in data_out.keys():
+        _shared_winds['out'][var][start:end] = data_out[var]
+
+    return start
+
+
+def calc_quantities_parallel(uwnd, vwnd, quantities, lat_axis, lon_axis, axis_order,
+                             workers, chunk_size=None, truncation=None, output_nlat=None):
+    """Calculate wind quantities, spreading time slabs across worker processes.
+
+    The spherical harmonic transforms for each time step are independent. 
+    The winds and output arrays are held in shared memory, and each worker 
+    keeps its own VectorWind instance (and Spharmt setup) for all the 
+    slabs it processes.
+
+    Args:
+      uwnd (numpy.ndarray): Zonal wind (time must be the first axis)
+      vwnd (numpy.ndarray): Meridional wind
+      quantities (list): Quantities to be calculated
+      lat_axis (list): Latitude axis values
+      lon_axis (list): Longitude axis values
+      axis_order (str): e.g. tyx
+      workers (int): Number of worker processes
+      chunk_size (int, optional): Number of time steps in each slab
+        [default = split the time axis evenly across the workers]
+      truncation (int, optional): Triangular truncation limit 
+      output_nlat (int, optional): Number of latitudes for a Gaussian 
+        output grid [default = input grid]
+
+    """
+
+    assert axis_order[0] == 't', "Time must be the first dimension"
+
+    shape = uwnd.shape
+    ntime = shape[0]
+    if not chunk_size:
+        chunk_size = int(math.ceil(ntime / float(workers)))
+
+    out_shape = list(shape)
+    if output_nlat:
+        out_shape[axis_order.index('y')] = output_nlat
+        out_shape[axis_order.index('x')] = 2 * output_nlat
+    out_shape = tuple(out_shape)
+
+    shared_u = RawArray('d', uwnd.size)
+    numpy.frombuffer(shared_u).reshape(shape)[:] = uwnd
+    shared_v = RawArray('d', vwnd.size)
+    numpy.frombuffer(shared_v).reshape(shape)[:] = vwnd
+
+    var_list = []
+    for quantity in quantities:
+        var_list.extend(quantity_vars[quantity])
+    shared_out = dict((var, RawArray('d', int(numpy.prod(out_shape)))) for var in var_list)
+
+    settings = {'quantities': quantities, 'lat_axis': lat_axis, 'lon_axis': lon_axis,
+                'axis_order': axis_order, 'truncation': truncation, 'output_nlat': output_nlat}
+    slab_bounds = [(start, min(start + chunk_size, ntime)) for start in xrange(0, ntime, chunk_size)]
+    initargs = (shared_u, shared_v, shared_out, shape, out_shape, settings)
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer=_init_wind_worker, initargs=initargs)
+        pool.map(_calc_slab, slab_bounds)
+        pool.close()
+        pool.join()
+    else:
+        _init_wind_worker(*initargs)
+        map(_calc_slab, slab_bounds)
+
+    data_out = dict((var, numpy.frombuffer(shared_out[var]).reshape(out_shape)) for var in var_list)
+
+    return data_out
+
+
+def shared_term(terms, name, func, *args, **kwargs):
+    """Return an intermediate term, only calculating it if it isn't in terms."""
+
+    if name not in terms:
+        terms[name] = func(*args, **kwargs)
+
+    return terms[name]
+
+
+def wind_quantities(w, quantities, truncation=None):
+    """Calculate wind quantities from a windspharm VectorWind instance.
+
+    Intermediate terms (e.g. the absolute vorticity, divergence and 
+    irrotational wind components) are only calculated once and are
+    shared by all the requested quantities.
+
+    Args:
+      w (windspharm.standard.VectorWind): Vector wind
+      quantities (list): Quantities to be calculated
+      truncation (int, optional): Triangular truncation limit for the
+        spherical harmonic computations. Quantities that are products of
+        other terms (e.g. the Rossby wave source) are truncated again 
+        after they are formed, so all quantities are consistent.
+
+    """
+
+    terms = {}
     data_out = {}
-    if quantity == 'rossbywavesource':
-        eta = w.absolutevorticity()
-        div = w.divergence()
-        uchi, vchi = w.irrotationalcomponent()
-        etax, etay = w.gradient(eta)
-
-        data_out['rws1'] = (-eta * div) / (1.e-11)
-        data_out['rws2'] = (-(uchi * etax + vchi * etay)) / (1.e-11)
-        data_out['rws'] = data_out['rws1'] + data_out['rws2']
-
-    elif quantity == 'magnitude':
-        data_out['spd'] = w.magnitude()
+    for quantity in quantities:
+        if quantity == 'rossbywavesource':
+            eta = shared_term(terms, 'avrt', w.absolutevorticity, truncation=truncation)
+            div = shared_term(terms, 'div', w.divergence, truncation=truncation)
+            uchi, vchi = shared_term(terms, 'chi', w.irrotationalcomponent, truncation=truncation)
+            etax, etay = shared_term(terms, 'avrt_gradient', w.gradient, eta, truncation=truncation)
+
+            data_out['rws1'] = truncate(w, -eta * div, truncation) / (1.e-11)
+            data_out['rws2'] = truncate(w, -(uchi * etax + vchi * etay), truncation) / (1.e-11)
+            data_out['rws'] = data_out['rws1'] + data_out['rws2']
+
+        elif quantity == 'magnitude':
+            data_out['spd'] = truncate(w, w.magnitude(), truncation)
     
-    elif quantity == 'vorticity':
-        data_out['vrt'] = w.vorticity()
+        elif quantity == 'vorticity':
+            data_out['vrt'] = w.vorticity(truncation=truncation)
     
-    elif quantity == 'divergence':
-        div = w.divergence()
-        data_out['div'] = div / (1.e-6)
+        elif quantity == 'divergence':
+            div = shared_term(terms, 'div', w.divergence, truncation=truncation)
+            data_out['div'] = div / (1.e-6)
     
-    elif quantity == 'absolutevorticity':
-        avrt = w.absolutevorticity()
-        data_out['avrt'] = avrt / (1.e-5)
+        elif quantity == 'absolutevorticity':
+            avrt = shared_term(terms, 'avrt', w.absolutevorticity, truncation=truncation)
+            data_out['avrt'] = avrt / (1.e-5)
     
-    elif quantity == 'absolutevorticitygradient':
-        avrt = w.absolutevorticity()
-        ugrad, vgrad = w.gradient(avrt)
-        avrtgrad = numpy.sqrt(numpy.square(ugrad) + numpy.square(vgrad)) 
-        data_out['avrtgrad'] = avrtgrad / (1.e-5)
+        elif quantity == 'absolutevorticitygradient':
+            avrt = shared_term(terms, 'avrt', w.absolutevorticity, truncation=truncation)
+            ugrad, vgrad = shared_term(terms, 'avrt_gradient', w.gradient, avrt, truncation=truncation)
+            avrtgrad = numpy.sqrt(numpy.square(ugrad) + numpy.square(vgrad)) 
+            data_out['avrtgrad'] = truncate(w, avrtgrad, truncation) / (1.e-5)
     
-    elif quantity == 'planetaryvorticity':
-        data_out['pvrt'] = w.planetaryvorticity()
+        elif quantity == 'planetaryvorticity':
+            data_out['pvrt'] = w.planetaryvorticity()
     
-    elif quantity == 'irrotationalcomponent':
-        data_out['uchi'], data_out['vchi'] = w.irrotationalcomponent()    
+        elif quantity == 'irrotationalcomponent':
+            data_out['uchi'], data_out['vchi'] = shared_term(terms, 'chi', w.irrotationalcomponent, truncation=truncation)    
     
-    elif quantity == 'nondivergentcomponent':
-        data_out['upsi'], data_out['vpsi'] = w.nondivergentcomponent() 
+        elif quantity == 'nondivergentcomponent':
+            data_out['upsi'], data_out['vpsi'] = w.nondivergentcomponent(truncation=truncation) 
     
-    elif quantity == 'streamfunction':
-        sf = w.streamfunction()
-        data_out['sf'] = sf / (1.e+6)
+        elif quantity == 'streamfunction':
+            sf = w.streamfunction(truncation=truncation)
+            data_out['sf'] = sf / (1.e+6)
     
-    elif quantity == 'velocitypotential':
-        vp = w.velocitypotential()
-        data_out['vp'] = vp / (1.e+6)
+        elif quantity == 'velocitypotential':
+            vp = w.velocitypotential(truncation=truncation)
+            data_out['vp'] = vp / (1.e+6)
     
-    else:
-        sys.exit('Wind quantity not recognised')
+        else:
+            sys.exit('Wind quantity not recognised')
+
+    return data_out
+
+
+def truncate(w, field, truncation):
+    """Apply a triangular truncation to a scalar field (if truncation is not None)."""
+
+    if truncation:
+        field = w.truncate(field, truncation=truncation)
+
+    return field
+
+
+def gaussian_grid(nlat, lat_axis, lon_axis):
+    """Latitude and longitude values for a Gaussian output grid.
+
+    The grid has 2 * nlat longitudes, starting from the first input 
+    longitude, and the latitude axis has the same orientation as 
+    the input latitude axis.
+
+    """
+
+    lats, wts = gaussian_lats_wts(nlat)
+    if lat_axis[0] < lat_axis[-1]:
+        lats = lats[::-1]
+    lons = lon_axis[0] + numpy.arange(2 * nlat) * 360.0 / (2 * nlat)
+
+    return lats, lons
+
+
+def output_spharmt(nlat):
+    """Get the (cached) Spharmt instance for a Gaussian output grid."""
+
+    if nlat not in _output_grids:
+        _output_grids[nlat] = Spharmt(2 * nlat, nlat, gridtype='gaussian')
+
+    return _output_grids[nlat]
+
+
+def regrid_quantities(w, data_out, output_nlat, truncation=None):
+    """Regrid the calculated quantities to a Gaussian output grid.
+
+    Scalar fields are regridded with spharm.regrid, but that would treat 
+    the components of a vector (e.g. uchi, vchi) as independent scalars, 
+    which is wrong near the poles. Vector components are instead converted 
+    to vorticity and divergence spectra on the input grid and the winds 
+    are recovered from those spectra on the output grid.
+
+    """
+
+    s_out = output_spharmt(output_nlat)
+    ntrunc = truncation if truncation else min(w.s.nlat, output_nlat) - 1
+
+    vector_keys = []
+    for uvar, vvar in vector_vars:
+        if uvar in data_out:
+            vrtspec, divspec = w.s.getvrtdivspec(data_out[uvar], data_out[vvar], ntrunc=ntrunc)
+            data_out[uvar], data_out[vvar] = s_out.getuv(vrtspec, divspec)
+            vector_keys.extend([uvar, vvar])
 
-    # Return data to its original shape
     for key in data_out.keys():
-        data_out[key] = recover_structure(data_out[key], flip_lat, uwnd_info) 
+        if not key in vector_keys:
+            data_out[key] = regrid(w.s, s_out, data_out[key], ntrunc=ntrunc)
 
     return data_out
 
@@ -233,46 +489,206 @@ def axis_letters(dim_list):
     return "".join(letter_list)
     
     
+def write_output(outfile, data_out, var_list, darray, global_atts, outfile_metadata,
+                 grid=None, truncation=None):
+    """Write the selected wind quantities to a netCDF file.
+
+    Args:
+      outfile (str): Output file name
+      data_out (dict): Calculated data (keys = variable names)
+      var_list (list): Variables to write to outfile
+      darray (xray.DataArray): Input wind data (to get the dimensions from)
+      global_atts (dict): Template global attributes
+      outfile_metadata (dict): History atts from each input file
+      grid (tuple, optional): Output (latitude, longitude) values, if 
+        different to the input grid
+      truncation (int, optional): Triangular truncation used
+
+    """
+
+    d = {}
+    for dim in darray.dims:
+        d[dim] = darray[dim]
+    if grid:
+        d['latitude'] = ('latitude', grid[0], darray['latitude'].attrs)
+        d['longitude'] = ('longitude', grid[1], darray['longitude'].attrs)
+
+    for var in var_list:
+        d[var] = (darray.dims, data_out[var])
+    
+    dset_out = xray.Dataset(d)
+
+    for var in var_list: 
+        dset_out[var].attrs = var_atts[var].copy()
+        if truncation:
+            dset_out[var].attrs['truncation'] = 'T%i' %(truncation)
+
+    gio.set_global_atts(dset_out, global_atts.copy(), outfile_metadata)
+    dset_out.to_netcdf(outfile, format='NETCDF3_CLASSIC')
+
+
+def get_level(darray):
+    """Get the single pressure level (and its attributes) of a DataArray.
+
+    The level comes from a level coordinate if present, or else from a 
+    level attribute like '500hPa' (as set by ncatted in the workflows).
+
+    """
+
+    if 'level' in darray.coords:
+        level_values = numpy.atleast_1d(darray['level'].values)
+        assert len(level_values) == 1, "Level files must contain a single level"
+        level = float(level_values[0])
+        level_atts = darray['level'].attrs
+    else:
+        assert 'level' in darray.attrs, "Level files need a level coordinate or attribute"
+        match = re.match('([0-9.]+)\s*(\w*)', darray.attrs['level'])
+        level = float(match.group(1))
+        level_atts = {'units': match.group(2)} if match.group(2) else {}
+
+    return level, level_atts
+
+
+def read_winds(infiles, var, subset_dict):
+    """Read a wind variable, stacking single level files along a level axis.
+
+    Args:
+      infiles (list): Input files (one file, or one file per level)
+      var (str): Variable name
+      subset_dict (dict): Keyword arguments for xray selection
+
+    Returns:
+      The (time, level, latitude, longitude) DataArray if there are 
+      multiple files, the global attributes of the first file and 
+      the history attribute of each file
+
+    """
+
+    darrays = []
+    history = {}
+    global_atts = None
+    for infile in infiles:
+        dset_in = xray.open_dataset(infile)
+        gio.check_xrayDataset(dset_in, var)
+        history[infile] = dset_in.attrs['history']
+        darrays.append(dset_in[var].sel(**subset_dict))
+        if global_atts is None:
+            global_atts = dset_in.attrs
+
+    if len(darrays) == 1:
+        return darrays[0], global_atts, history
+
+    levels = []
+    for index, darray in enumerate(darrays):
+        level, level_atts = get_level(darray)
+        levels.append(level)
+        if 'level' in darray.dims:
+            darray = darray.isel(level=0)
+        if 'level' in darray.coords:
+            darray = darray.reset_coords('level', drop=True)
+        darrays[index] = darray
+
+    darray = xray.concat(darrays, dim=pandas.Index(levels, name='level'))
+    darray['level'].attrs = level_atts
+    if 'level' in darray.attrs:
+        del darray.attrs['level']
+
+    dim_order = list(darray.dims)
+    dim_order.remove('level')
+    dim_order.insert(dim_order.index('time') + 1 if 'time' in dim_order else 0, 'level')
+    darray = darray.transpose(*dim_order)
+
+    return darray, global_atts, history
+
+
+def get_outfile_groups(inargs):
+    """Get the list of output files and the variables to write to each."""
+
+    if inargs.outfiles:
+        assert len(inargs.outfiles) == len(inargs.quantities), \
+        "Must provide an output file for each of the --quantities"
+        quantity_groups = [(inargs.outfile, [inargs.quantity])]
+        quantity_groups.extend([(outfile, [quantity]) for outfile, quantity in zip(inargs.outfiles, inargs.quantities)])
+    else:
+        quantity_groups = [(inargs.outfile, [inargs.quantity] + inargs.quantities)]
+
+    outfile_groups = []
+    for outfile, quantities in quantity_groups:
+        var_list = []
+        for quantity in quantities:
+            var_list.extend(quantity_vars[quantity])
+        outfile_groups.append((outfile, var_list))
+
+    return outfile_groups
+
+
 def main(inargs):
     """Run the program."""
 
     # Read the data
-    dset_in_u = xray.open_dataset(inargs.infileu)
-    gio.check_xrayDataset(dset_in_u, inargs.varu)
-
-    dset_in_v = xray.open_dataset(inargs.infilev)
-    gio.check_xrayDataset(dset_in_v, inargs.varv)
+    ufiles = [inargs.infileu]
+    vfiles = [inargs.infilev]
+    if inargs.extra_level:
+        ufiles.extend([ufile for ufile, vfile in inargs.extra_level])
+        vfiles.extend([vfile for ufile, vfile in inargs.extra_level])
 
     subset_dict = gio.get_subset_kwargs(inargs)
-       
-    darray_u = dset_in_u[inargs.varu].sel(**subset_dict)
-    darray_v = dset_in_v[inargs.varv].sel(**subset_dict)
+    darray_u, global_atts, u_history = read_winds(ufiles, inargs.varu, subset_dict)
+    darray_v, v_atts, v_history = read_winds(vfiles, inargs.varv, subset_dict)
 
     lat_axis = darray_u['latitude'].values
     lon_axis = darray_u['longitude'].values    
     axis_order = axis_letters(darray_u.dims)
     
-    # Calculate the desired quantity
-    data_out = calc_quantity(darray_u.values, darray_v.values, inargs.quantity,
-                             lat_axis, lon_axis, axis_order)
-
-    # Write the output file
-    d = {}
-    for dim in darray_u.dims:
-        d[dim] = darray_u[dim]
-
-    for var in data_out.keys():
-        d[var] = (darray_u.dims, data_out[var])
-    
-    dset_out = xray.Dataset(d)
+    # Calculate the desired quantities and write the output file/s
+    quantities = [inargs.quantity] + inargs.quantities
+    outfile_groups = get_outfile_groups(inargs)
+    outfile_metadata = u_history.copy()
+    outfile_metadata.update(v_history)
+    grid = gaussian_grid(inargs.gaussian_nlat, lat_axis, lon_axis) if inargs.gaussian_nlat else None
+    spectral_kwargs = {'truncation': inargs.truncation, 'output_nlat': inargs.gaussian_nlat}
+    output_kwargs = {'grid': grid, 'truncation': inargs.truncation}
+
+    if inargs.workers > 1:
+        data_out = calc_quantities_parallel(darray_u.values, darray_v.values, quantities,
+                                            lat_axis, lon_axis, axis_order, 
+                                            inargs.workers, chunk_size=inargs.chunk_size,
+                                            **spectral_kwargs)
+        for outfile, var_list in outfile_groups:
+            write_output(outfile, data_out, var_list, darray_u, global_atts, outfile_metadata,
+                         **output_kwargs)
+
+    elif inargs.chunk_size:
+        assert darray_u.dims[0] == 'time', "Time must be the first dimension for streaming"
+        temp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(inargs.outfile)))
+        temp_files = [[] for group in outfile_groups]
+        try:
+            w = None
+            ntime = darray_u.shape[0]
+            for start in xrange(0, ntime, inargs.chunk_size):
+                slab_u = darray_u[start:start + inargs.chunk_size]
+                slab_v = darray_v[start:start + inargs.chunk_size]
+                data_out, w = calc_quantities(slab_u.values, slab_v.values, quantities,
+                                              lat_axis, lon_axis, axis_order, w=w, **spectral_kwargs)
+                for group_num, (outfile, var_list) in enumerate(outfile_groups):
+                    temp_file = os.path.join(temp_dir, 'group%i_slab%i.nc' %(group_num, start))
+                    write_output(temp_file, data_out, var_list, slab_u, global_atts, outfile_metadata,
+                                 **output_kwargs)
+                    temp_files[group_num].append(temp_file)
+
+            for (outfile, var_list), group_files in zip(outfile_groups, temp_files):
+                dset_out = xray.open_mfdataset(group_files)
+                dset_out.to_netcdf(outfile, format='NETCDF3_CLASSIC')
+                dset_out.close()
+        finally:
+            shutil.rmtree(temp_dir)
 
-    for var in data_out.keys(): 
-        dset_out[var].attrs = var_atts[var]
-
-    outfile_metadata = {inargs.infileu: dset_in_u.attrs['history'],
-                        inargs.infilev: dset_in_v.attrs['history']}
-    gio.set_global_atts(dset_out, dset_in_u.attrs, outfile_metadata)
-    dset_out.to_netcdf(inargs.outfile, format='NETCDF3_CLASSIC')
+    else:
+        data_out, w = calc_quantities(darray_u.values, darray_v.values, quantities,
+                                      lat_axis, lon_axis, axis_order, **spectral_kwargs)
+        for outfile, var_list in outfile_groups:
+            write_output(outfile, data_out, var_list, darray_u, global_atts, outfile_metadata,
+                         **output_kwargs)
  
     
 if __name__ == '__main__':
@@ -298,7 +714,21 @@ wind quantities:
                                  advection of absolute vorticity by divergent flow terms)
                     
 note:
-  The input data can have no missing values
+  The input data can have no missing values.
+  Any number of quantities can be calculated in the one run (see --quantities),
+  which means the input data are only read and transformed once.
+  With --chunk_size the time axis is processed one slab at a time (reusing the 
+  spherical harmonic grid setup) and the slabs are combined at the end.
+  With --workers N the slabs (of --chunk_size time steps, or the time axis split 
+  evenly across the workers) are processed in parallel. The full record is held
+  in (shared) memory in that case.
+  The input files can have a level axis, i.e. (time, level, latitude, longitude). 
+  Alternatively, single level files can be stacked along a level axis using 
+  --extra_level (the level comes from the level coordinate or attribute of each 
+  file). All levels are processed together in the one spherical harmonic pass.
+  With --truncation T every quantity is calculated at triangular truncation T.
+  Combined with --gaussian_nlat (e.g. T42 and 64 latitudes) the output is written 
+  on the corresponding coarser Gaussian grid.
 
 reference:
   Uses the windspharm package: http://ajdawson.github.com/windspharm/intro.html
@@ -321,10 +751,7 @@ author:
                                      formatter_class=argparse.RawDescriptionHelpFormatter)
 
     parser.add_argument("quantity", type=str, help="Quantity to calculate",
-                        choices=['magnitude', 'vorticity', 'divergence', 'absolutevorticity', 
-                                 'absolutevorticitygradient', 'planetaryvorticity',
-                                 'irrotationalcomponent', 'nondivergentcomponent', 
-                                 'streamfunction', 'velocitypotential', 'rossbywavesource'])
+                        choices=quantity_vars.keys())
     parser.add_argument("infileu", type=str, help="Input U-wind file name")
     parser.add_argument("varu", type=str, help="Input U-wind variable")
     parser.add_argument("infilev", type=str, help="Input V-wind file name")
@@ -336,9 +763,29 @@ author:
     parser.add_argument("--time", type=str, nargs=2, metavar=('START_DATE', 'END_DATE'),
                         help="Time period [default = entire]")
 
+    parser.add_argument("--extra_level", type=str, nargs=2, action='append', default=None,
+                        metavar=('UFILE', 'VFILE'),
+                        help="Single level U and V files for another level, to be stacked with the input files and processed together [default = None]")
+
+    parser.add_argument("--quantities", type=str, nargs='*', default=[], 
+                        choices=quantity_vars.keys(),
+                        help="Additional quantities to calculate from the same vector wind [default = None]")
+    parser.add_argument("--outfiles", type=str, nargs='*', default=None, 
+                        help="Separate output file for each of the --quantities (in the same order) [default = write all quantities to outfile]")
+
+    parser.add_argument("--chunk_size", type=int, default=None, 
+                        help="Process the data this many time steps at a time, so memory use doesn't grow with record length [default = all at once]")
+    parser.add_argument("--workers", type=int, default=1, 
+                        help="Number of processes to spread the time slabs across [default = 1]")
+
+    parser.add_argument("--truncation", type=int, default=None, 
+                        help="Triangular truncation for the spherical harmonic computations (e.g. 42) [default = none]")
+    parser.add_argument("--gaussian_nlat", type=int, default=None, 
+                        help="Write the output on a Gaussian grid with this many latitudes (e.g. 64 for T42) [default = input grid]")
+
     args = parser.parse_args()  
     
-    print 'Quantity:', args.quantity
+    print 'Quantities:', [args.quantity] + args.quantities
     print 'Input U file: ', args.infileu
     print 'Input V file: ', args.infilev
     print 'Output file:', args.outfile
@@ -1,6 +1,6 @@
 #
 # Description: For global daily data, calc_wind_quantities.py can only handle a few years of data at a time
-# (on abyss and/or vortex.earthsci.unimelb.edu.au) 
+# (on abyss and/or vortex.earthsci.unimelb.edu.au), so the data are streamed through one year at a time
 #
 
 function usage {
@@ -52,17 +52,7 @@ else
 fi
 
 
-years=(1979 1982 1985 1988 1991 1994 1997 2000 2003 2006 2009 2012)
-temp_files=()
-for year in "${years[@]}"; do
-    end=`expr $year + 2`
-    temp_file=${temp_dir}/temp-${quantity}_${year}-${end}.nc
-    ${python_exe} ${code_dir}/calc_wind_quantities.py ${quantity} $ufile $uvar $vfile $vvar ${temp_file} --time ${year}-01-01 ${end}-12-31 
-    temp_files+=(${temp_file})
-done
-
-cdo -O mergetime ${temp_files[@]} $outfile
-rm ${temp_files[@]}
-
-
+# temp_dir is retained in the interface for existing callers; the slabs are
+# now processed (and temporarily stored) by calc_wind_quantities.py itself
+${python_exe} ${code_dir}/calc_wind_quantities.py ${quantity} $ufile $uvar $vfile $vvar $outfile --chunk_size 365
 
@@ -8,7 +8,9 @@ Description:  Calculate the zonal anomaly (i.e. subtract the zonal mean at each
 # Import general Python modules
 
 import os, sys, pdb
+import warnings
 import argparse
+import numpy
 import xarray
 
 # Import my modules
@@ -31,19 +33,51 @@ except ImportError:
 
 # Define fuctions
 
+def zonal_anomaly_block(block, lon_axis, out_dtype):
+    """Subtract the zonal mean from a block of data.
+
+    Like the xarray mean, missing (NaN) values are ignored when calculating
+    the zonal mean. The input block is not modified.
+
+    Args:
+      block (numpy.ndarray): Data (e.g. one time slab)
+      lon_axis (int): Index of the longitude axis
+      out_dtype (numpy.dtype): Output data type
+
+    """
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)  # all NaN rows
+        zonal_mean = numpy.nanmean(block, axis=lon_axis, keepdims=True)
+
+    anomaly = block.astype(out_dtype)
+    anomaly -= zonal_mean
+
+    return anomaly
+
+
 def main(inargs):
     """Run the program."""
     
     # Read the data
-    dset_in = xarray.open_dataset(inargs.infile)
+    chunks = {'time': inargs.chunk_size} if inargs.chunk_size else None
+    dset_in = xarray.open_dataset(inargs.infile, chunks=chunks)
     gio.check_xarrayDataset(dset_in, inargs.variable)
 
     subset_dict = gio.get_subset_kwargs(inargs)
     darray = dset_in[inargs.variable].sel(**subset_dict)
       
     # Calculate the zonal anomaly
-    zonal_mean = darray.mean(dim='longitude')
-    zonal_anomaly = darray - zonal_mean
+    if inargs.float32:
+        out_dtype = numpy.float32
+    else:
+        out_dtype = darray.dtype if darray.dtype.kind == 'f' else numpy.float64
+    lon_axis = darray.dims.index('longitude')
+    if inargs.chunk_size:
+        zonal_anomaly = darray.data.map_blocks(zonal_anomaly_block, lon_axis=lon_axis, 
+                                               out_dtype=out_dtype, dtype=out_dtype)
+    else:
+        zonal_anomaly = zonal_anomaly_block(darray.values, lon_axis, out_dtype)
 
     # Write output file
     d = {}
@@ -68,6 +102,11 @@ if __name__ == '__main__':
 example (vortex.earthsci.unimelb.edu.au):
   /usr/local/anaconda/bin/python calc_zonal_anomaly.py 
   zg_Merra_250hPa_monthly_native.nc zg zg_Merra_250hPa_monthly-zonal-anom_native.nc
+
+note:
+  With --chunk_size the data are read lazily in time slabs (using dask), the zonal
+  mean is subtracted from each slab and the slabs are written to the 
+  output file as they are calculated, so memory use doesn't grow with record length.
 """    	
 
     description = 'Calculate the zonal anomaly (i.e. subtract the zonal mean at each timestep).'
@@ -83,6 +122,11 @@ example (vortex.earthsci.unimelb.edu.au):
     parser.add_argument("--time", type=str, nargs=2, metavar=('START_DATE', 'END_DATE'),
                         help="Time period [default = entire]")
 
+    parser.add_argument("--chunk_size", type=int, default=None,
+                        help="Read, process and write the data this many time steps at a time [default = all at once]")
+    parser.add_argument("--float32", action="store_true", default=False,
+                        help="Write the output as float32 (regardless of the input data type) [default: False]")
+
     args = parser.parse_args()            
 
     print 'Input file: ', args.infile
@@ -1,6 +1,6 @@
 #
 # Description: For global daily data, calc_zonal_anomaly.py can only handle 5 years of data at a time
-# (on abyss and/or vortex.earthsci.unimelb.edu.au) 
+# (on abyss and/or vortex.earthsci.unimelb.edu.au), so the data are streamed through one year at a time
 #
 
 function usage {
@@ -33,14 +33,5 @@ if [ ! -f $infile ] ; then
     usage
 fi
 
-years=(1979 1984 1989 1994 1999 2004 2009 2014)
-temp_files=()
-for year in "${years[@]}"; do
-    end=`expr $year + 4`
-    temp_file=${temp_dir}/temp-zonal-anom_${year}-${end}.nc
-    ${python_exe} ${code_dir}/calc_zonal_anomaly.py $infile $invar ${temp_file} --time ${year}-01-01 ${end}-12-31
-    temp_files+=(${temp_file})
-done
+${python_exe} ${code_dir}/calc_zonal_anomaly.py $infile $invar $outfile --chunk_size 365
 
-cdo -O mergetime ${temp_files[@]} $outfile
-rm ${temp_files[@]}
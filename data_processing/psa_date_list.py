@@ -5,9 +5,8 @@ import argparse
 import numpy, pandas
 import xray
 import operator
+import itertools
 from itertools import groupby
-from scipy import stats
-from scipy.stats import rankdata
 
 # Import my modules
 
@@ -33,16 +32,26 @@ except ImportError:
 season_months = {'DJF': (12, 1, 2), 'MAM': (3, 4, 5), 
                  'JJA': (6, 7, 8), 'SON': (9, 10, 11)}
 
-def fix_boundary_data(data, freq):
-    """If a data series straddles 0/60, adjust accordingly."""
+def fix_boundary_data(data, freq, groups=None):
+    """If a data series straddles 0/60, adjust accordingly.
+
+    If groups (an array of group labels 0, 1, 2, ..., e.g. event numbers) 
+    is given, each group is treated as a separate series. Groups must be 
+    contiguous (i.e. consecutive rows of the same group).
+
+    """
 
     assert freq == 6, "At the moment fix_boundary_data() is hard-wired to a freq of 6"
 
     data = numpy.array(data)
-    if len(data) > 1: 
-	diffs = numpy.abs(numpy.diff(data))
-	if diffs.max() > 50:
-            data = numpy.where(data < 30, data + 60, data)
+    if groups is None:
+        groups = numpy.zeros(len(data), dtype=int)
+
+    if len(data) > 1:
+        same_group = groups[1:] == groups[:-1]
+        big_jump = (numpy.abs(numpy.diff(data)) > 50) & same_group
+        straddles = numpy.bincount(groups[1:][big_jump], minlength=groups.max() + 1) > 0
+        data = numpy.where(straddles[groups] & (data < 30), data + 60, data)
 
     return data
 
@@ -64,6 +73,34 @@ def set_phase_bounds(user_bounds, freq):
     return phase_min, phase_max
 
 
+def grouped_slope(y, groups):
+    """Calculate the linear regression slope of y against 0, 1, 2, ... for each group.
+
+    Closed form least squares slope, with the sums for every group 
+    calculated at once. Groups must be contiguous and labelled 0, 1, 2, ...
+    Groups with only one value have a slope of NaN. 
+
+    """
+
+    if not len(groups):
+        return numpy.zeros(0)
+
+    ngroups = groups.max() + 1
+    counts = numpy.bincount(groups, minlength=ngroups).astype(float)
+    starts = numpy.cumsum(counts) - counts
+    x = numpy.arange(len(y)) - starts[groups]
+
+    sum_x = numpy.bincount(groups, weights=x, minlength=ngroups)
+    sum_y = numpy.bincount(groups, weights=y, minlength=ngroups)
+    sum_xx = numpy.bincount(groups, weights=x * x, minlength=ngroups)
+    sum_xy = numpy.bincount(groups, weights=x * y, minlength=ngroups)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        slopes = (sum_xy - sum_x * sum_y / counts) / (sum_xx - sum_x**2 / counts)
+
+    return slopes
+
+
 def event_info(df, freq):
     """Add columns to the DataFrame that contain event information."""
 
@@ -71,111 +108,284 @@ def event_info(df, freq):
     df['time_delta'] = df['dates'].diff()
     df['in_event'] = df['time_delta'] < pandas.tslib.Timedelta('2 days')
 
-    # Event number
-    event_number = -1
-    event_list = []
-    for index, row in df.iterrows():
-        if not row['in_event']:
-            event_number = event_number + 1
-        event_list.append(event_number)
-    df['event_number'] = event_list
-
-    # Event duration and gradient
-    duration_list = []
-    gradient_list = []
-    phase_list = []
+    if not len(df.index):
+        # No events (e.g. after strict filtering)
+        for column, dtype in [('event_number', int), ('event_duration', int), ('event_phase', float),
+                              ('event_gradient', float), ('event_start', bool), ('event_end', bool)]:
+            df[column] = numpy.zeros(0, dtype=dtype)
+        return df
+
+    # Event number (a new event starts whenever there is a gap)
+    in_event = df['in_event'].values
+    event_numbers = numpy.cumsum(~in_event) - 1
+    df['event_number'] = event_numbers
+
+    # Event duration, phase and gradient
+    durations = numpy.bincount(event_numbers)
     target_freq = 'wave%i_phase' %(freq)
-    for event in range(0, event_number + 1):
-        event_duration = event_list.count(event)
-        event_phase_data = fix_boundary_data(df[target_freq].loc[df['event_number'] == event].values, freq)
-        event_gradient, intercept, r_value, p_value, std_err = stats.linregress(numpy.arange(0, event_duration), event_phase_data)
-        
-        duration_list = duration_list + [event_duration] * event_duration
-        phase_list = phase_list + list(event_phase_data)
-        gradient_list = gradient_list + [event_gradient] * event_duration
-
-    df['event_duration'] = duration_list
-    df['event_phase'] = phase_list
-    df['event_gradient'] = gradient_list
+    event_phase = fix_boundary_data(df[target_freq].values, freq, groups=event_numbers)
+    gradients = grouped_slope(event_phase, event_numbers)
+
+    df['event_duration'] = durations[event_numbers]
+    df['event_phase'] = event_phase
+    df['event_gradient'] = gradients[event_numbers]
 
     # Flag start and end data times
-    start_bool = [False] * len(df.index)
-    end_bool = [False] * len(df.index)
-    row_num = 0
-    for index, row in df.iterrows():
-        if row['in_event'] == False:
-            start_bool[row_num] = True
-            end_bool[row_num + row['event_duration'] - 1] = True
-        row_num = row_num + 1    
-
-    df['event_start'] = start_bool
-    df['event_end'] = end_bool
+    df['event_start'] = ~in_event
+    df['event_end'] = numpy.append(~in_event[1:], True)
 
     return df
   
 
+def rank_amplitudes(df):
+    """Replace the values in the amplitude columns with their ranking for each time.
+
+    The (time, wave) amplitude matrix is ranked with a single argsort 
+    (1 = smallest amplitude). 
+
+    """
+
+    amp_columns = [column for column in df.columns if 'amp' in column]
+    amps = df[amp_columns].values
+
+    ntimes, nwaves = amps.shape
+    order = numpy.argsort(amps, axis=1)
+    ranks = numpy.empty(amps.shape)
+    ranks[numpy.arange(ntimes)[:, numpy.newaxis], order] = numpy.arange(1, nwaves + 1)
+
+    rank_df = df.copy()
+    rank_df[amp_columns] = ranks
+
+    return rank_df
+
+
+def in_top_waves(rank_df, waves, min_rank_sum=17, top_k=None):
+    """Test whether the target waves have the largest amplitudes.
+
+    By default the sum of the target wave rankings must be at least 
+    min_rank_sum (e.g. for waves 5 and 6 out of 10, a sum of at least 17 
+    accepts the rank pairs 10+9, 10+8, 10+7 and 9+8). 
+    If top_k is given, all the target waves must instead be amongst 
+    the top_k amplitudes.
+
+    Args:
+      rank_df (pandas.DataFrame): Amplitude rankings (from rank_amplitudes)
+      waves (list): Target wave numbers
+      min_rank_sum (int): Minimum sum of the target wave rankings
+      top_k (int, optional): Use the top_k test instead of the rank sum
+
+    """
+
+    target_ranks = rank_df[['wave%i_amp' %(wave) for wave in waves]].values
+
+    if top_k:
+        amp_columns = [column for column in rank_df.columns if 'amp' in column]
+        nwaves = len(amp_columns)
+        included = (target_ranks > nwaves - top_k).all(axis=1)
+    else:
+        included = target_ranks.sum(axis=1) >= min_rank_sum
+
+    return included
+
+
+def get_event_table(rank_df, freq, max_sign_change=None):
+    """Reject days that change sign too much and add the event information."""
+
+    if max_sign_change:
+        rank_df = rank_df.loc[rank_df['sign_count'] <= max_sign_change]
+
+    return event_info(rank_df.copy(), freq)
+
+
+def get_filter_mask(df, freq, duration_filter=None, season_filter=None, phase_filter=None, months=None):
+    """Get a boolean mask for the rows that pass the duration, season and phase filters.
+
+    Args:
+      months (numpy.ndarray, optional): Month of each row (saves decoding the dates again)
+
+    """
+
+    mask = numpy.ones(len(df.index), dtype=bool)
+
+    # Optional filtering by duration
+    if duration_filter:
+        mask = mask & (df['event_duration'].values > duration_filter)
+
+    # Optional filtering by season
+    if season_filter:
+        if months is None:
+            months = pandas.to_datetime(df.index.values).month
+        mask = mask & numpy.in1d(months, season_months[season_filter])
+
+    # Optional filtering by wave phase
+    if phase_filter:
+        phase_min, phase_max = set_phase_bounds(phase_filter, freq)
+        target_phase = 'wave%i_phase' %(freq)
+        min_bools = (df[target_phase] > phase_min).values
+        max_bools = (df[target_phase] < phase_max).values
+        if phase_min < phase_max:
+            mask = mask & numpy.logical_and(min_bools, max_bools)
+        else:
+            mask = mask & numpy.logical_or(min_bools, max_bools)
+
+    return mask
+
+
+def sweep_outfile(output_file, max_sign_change, duration_filter, season_filter, phase_filter):
+    """Generate an output file name for one combination of filter settings."""
+
+    labels = []
+    if max_sign_change:
+        labels.append('signchange-le%i' %(max_sign_change))
+    if duration_filter:
+        labels.append('duration-gt%i' %(duration_filter))
+    if season_filter:
+        labels.append(season_filter)
+    if phase_filter:
+        labels.append(('phase%g-%g' %tuple(phase_filter)).replace('.', 'p'))
+    if not labels:
+        labels.append('nofilter')
+
+    fname, extension = output_file.split('.')
+
+    return '%s_%s.%s' %(fname, '_'.join(labels), extension)
+
+
+def _sweep_values(values, convert):
+    """Convert the command line sweep values ('none' = no filter)."""
+
+    if not values:
+        return [None]
+
+    return [None if value == 'none' else convert(value) for value in values]
+
+
+def parse_phase(phase_str):
+    """Convert a MIN,MAX phase string to a list of floats."""
+
+    return [float(value) for value in phase_str.split(',')]
+
+
+def run_sweep(rank_df, inargs, metadata_dict):
+    """Write a date list for every combination of filter settings.
+
+    The ranked table is calculated once. The event information depends on 
+    the maximum sign change, so it is calculated once per max_sign_change value,
+    and the remaining filters are applied as boolean masks.
+
+    """
+
+    sign_values = _sweep_values(inargs.sweep_max_sign_change, int)
+    duration_values = _sweep_values(inargs.sweep_duration, int)
+    season_values = _sweep_values(inargs.sweep_season, str)
+    phase_values = _sweep_values(inargs.sweep_phase, parse_phase)
+
+    for max_sign_change in sign_values:
+        table = get_event_table(rank_df, inargs.freq, max_sign_change=max_sign_change)
+        months = pandas.to_datetime(table.index.values).month
+        dates = table.index.values
+        for duration_filter, season_filter, phase_filter in itertools.product(duration_values, season_values, phase_values):
+            mask = get_filter_mask(table, inargs.freq, duration_filter=duration_filter, 
+                                   season_filter=season_filter, phase_filter=phase_filter, months=months)
+
+            outfile = sweep_outfile(inargs.output_file, max_sign_change, duration_filter, season_filter, phase_filter)
+            gio.write_dates(outfile, dates[mask])
+
+            settings = 'Filter settings: max_sign_change=%s, duration_filter=%s, season_filter=%s, phase_filter=%s' %(str(max_sign_change), 
+                       str(duration_filter), str(season_filter), str(phase_filter))
+            gio.write_metadata(outfile, file_info=metadata_dict, extra_notes=[settings])
+            print outfile
+
+
+def write_event_table(df, outfile, history):
+    """Write the full event table to a columnar netCDF file.
+
+    Each column becomes a variable on the time (date) dimension, so readers 
+    can open the file lazily (e.g. with xray and the scipy engine, which 
+    memory-maps netCDF3 files) and load only the columns they need. 
+
+    The netCDF3 format has no boolean, 64-bit integer or timedelta types, so 
+    flags are stored as int8 (0/1), integers as int32 and the time_delta 
+    column is dropped (it is recoverable from the time axis). The dates 
+    column duplicates the index and is also dropped.
+
+    """
+
+    df = df.drop(['dates', 'time_delta'], axis=1)
+    df.index.name = 'time'
+
+    for column in df.columns:
+        if df[column].dtype == bool:
+            df[column] = df[column].astype(numpy.int8)
+        elif df[column].dtype.kind in 'iu':
+            df[column] = df[column].astype(numpy.int32)
+
+    dset_out = xray.Dataset.from_dataframe(df)
+    for column in df.columns:
+        if df[column].dtype == numpy.int8:
+            dset_out[column].attrs['flag_values'] = numpy.array([0, 1], dtype=numpy.int8)
+            dset_out[column].attrs['flag_meanings'] = 'false true'
+    dset_out.attrs['history'] = history
+
+    dset_out.to_netcdf(outfile, format='NETCDF3_CLASSIC')
+
+
 def main(inargs):
     """Run the program"""
 
     # Read data
     dset_in = xray.open_dataset(inargs.fourier_file)
     df = dset_in.to_dataframe()
+    metadata_dict = {inargs.fourier_file: dset_in.attrs['history']}
 
     # Change the amplitue columns so the value is a ranking
-    amp_df = df.loc[:, df.columns.map(lambda x: 'amp' in x)]
-    rank_df = amp_df.apply(rankdata, axis=1)
-    rank_df = rank_df.combine_first(df)
+    rank_df = rank_amplitudes(df)
 
-    # Select the ones where wave 5 and 6 are in the top 3 amplitudes
-    # (worst ranking must be 8 + 9 = 17) 
-    included = (rank_df['wave5_amp'].values + rank_df['wave6_amp'].values) >= 17
-    final = rank_df.loc[included]
+    # Select the ones where the target waves (e.g. 5 and 6) have the largest amplitudes
+    included = in_top_waves(rank_df, inargs.waves, min_rank_sum=inargs.min_rank_sum, top_k=inargs.top_k)
+    rank_df = rank_df.loc[included]
 
-    # Reject days that change sign too much
-    if inargs.max_sign_change:
-        final = final.loc[final['sign_count'] <= inargs.max_sign_change]
+    if inargs.sweep:
+        run_sweep(rank_df, inargs, metadata_dict)
+        return
 
-    final = event_info(final, inargs.freq)
+    final = get_event_table(rank_df, inargs.freq, max_sign_change=inargs.max_sign_change)
 
     if inargs.full_stats:
         assert not inargs.phase_filter and not inargs.season_filter and not inargs.duration_filter, \
         "Cannot filter by phase, season or duration for full stats, because then they would not be full!"
-        final.to_csv(inargs.output_file)
+        if inargs.output_file[-3:] == '.nc':
+            write_event_table(final, inargs.output_file, gio.write_metadata(file_info=metadata_dict))
+        else:
+            final.to_csv(inargs.output_file)
 
     else: 
-        # Optional filtering by duration
-        if inargs.duration_filter:
-            final = final.loc[final['event_duration'] > inargs.duration_filter]
-
-        # Optional filtering by season
-        if inargs.season_filter:
-            season = inargs.season_filter
-            months_subset = pandas.to_datetime(final.index.values).month
-            bools_subset = (months_subset == season_months[season][0]) + (months_subset == season_months[season][1]) + (months_subset == season_months[season][2])
-            final = final.loc[bools_subset]
-
-        # Optional filtering by wave phase
-        if inargs.phase_filter:
-            phase_min, phase_max = set_phase_bounds(inargs.phase_filter, inargs.freq)
-            target_phase = 'wave%i_phase' %(inargs.freq)
-            min_bools = (final[target_phase] > phase_min).values
-            max_bools = (final[target_phase] < phase_max).values
-            if phase_min < phase_max:
-                final = final.loc[numpy.logical_and(min_bools, max_bools)]
-            else:
-                final = final.loc[numpy.logical_or(min_bools, max_bools)]
+        mask = get_filter_mask(final, inargs.freq, duration_filter=inargs.duration_filter,
+                               season_filter=inargs.season_filter, phase_filter=inargs.phase_filter)
+        final = final.loc[mask]
 
         # Write date file
         gio.write_dates(inargs.output_file, final.index.values)
 
-    metadata_dict = {inargs.fourier_file: dset_in.attrs['history']}
     gio.write_metadata(inargs.output_file, file_info=metadata_dict)
 
 
 if __name__ == '__main__':
 
+    extra_info =""" 
+sweep:
+  With --sweep a date list is written for every combination of the values given 
+  to the --sweep_* options (each defaults to no filter, and 'none' can be included
+  to also get the unfiltered case). The filter settings are appended to the output 
+  file name and recorded in the metadata file, e.g.
+    python psa_date_list.py fourier.nc dates-psa.txt --sweep 
+    --sweep_duration none 5 10 --sweep_season DJF MAM JJA SON --sweep_phase 10,20 50,10
+
+"""
+
     description='Create a psa date list (or stats csv) from Fourier information'
     parser = argparse.ArgumentParser(description=description, 
+                                     epilog=extra_info, 
                                      argument_default=argparse.SUPPRESS,
                                      formatter_class=argparse.RawDescriptionHelpFormatter)
 
@@ -187,8 +397,15 @@ if __name__ == '__main__':
     parser.add_argument("--freq", type=int, default=6, 
                         help="frequency used for phase filtering and event gradient calculation [default = 6]")
 
+    parser.add_argument("--waves", type=int, nargs='*', default=[5, 6], 
+                        help="target waves that must have the largest amplitudes [default = 5 6]")
+    parser.add_argument("--min_rank_sum", type=int, default=17, 
+                        help="minimum sum of the target wave amplitude rankings (1 = smallest) [default = 17]")
+    parser.add_argument("--top_k", type=int, default=None, 
+                        help="instead of the rank sum test, require the target waves to all be amongst the top_k amplitudes [default = None]")
+
     parser.add_argument("--full_stats", action="store_true", default=False,
-                        help="switch for outputting a full stats file instead of just dates [default: False]")
+                        help="switch for outputting a full stats file instead of just dates (.nc output file gives columnar netCDF, otherwise csv) [default: False]")
 
     parser.add_argument("--duration_filter", type=int, default=None, 
                         help="minimum duration for a PSA event [default = no filter]")
@@ -197,5 +414,16 @@ if __name__ == '__main__':
     parser.add_argument("--phase_filter", type=float, nargs=2, metavar=['MIN_PHASE', 'MAX_PHASE'], default=None, 
                         help="phase range to retain at the given frequecy. [default = no filter]")
 
+    parser.add_argument("--sweep", action="store_true", default=False,
+                        help="write a date list for every combination of the --sweep_* filter values [default: False]")
+    parser.add_argument("--sweep_max_sign_change", type=str, nargs='*', default=None, 
+                        help="max_sign_change values for the sweep ('none' = not applied)")
+    parser.add_argument("--sweep_duration", type=str, nargs='*', default=None, 
+                        help="duration_filter values for the sweep ('none' = not applied)")
+    parser.add_argument("--sweep_season", type=str, nargs='*', default=None, choices=('DJF', 'MAM', 'JJA', 'SON', 'none'), 
+                        help="season_filter values for the sweep ('none' = not applied)")
+    parser.add_argument("--sweep_phase", type=str, nargs='*', default=None, metavar='MIN_PHASE,MAX_PHASE', 
+                        help="phase_filter ranges for the sweep ('none' = not applied)")
+
     args = parser.parse_args()            
     main(args)
@@ -5,8 +5,10 @@ Functions:
   apply_lon_filter   -- Set values outside of specified longitude range to zero
   broadcast_array    -- Broadcast an array to a target shape
   calc_significance  -- Perform significance test
+  calc_significance_from_moments -- Perform significance test given the sample moments
   coordinate_paris   -- Generate lat/lon pairs
   dict_filter        -- Filter dictionary according to specified keys
+  effective_sample_size -- Calculate the effective sample size of autocorrelated data
   find_nearest       -- Find the closest array item to value
   find_duplicates    -- Return list of duplicates in a list
   fix_label          -- Fix formatting of an axis label taken from the command line
@@ -117,37 +119,49 @@ def broadcast_array(array, axis_index, shape):
     return array
 
 
-def calc_significance(data_subset, data_all, standard_name):
+def calc_significance(data_subset, data_all, standard_name, method='full', max_lag=None):
     """Perform significance test.
 
     One sample t-test, with sample size adjusted for autocorrelation.
+    See effective_sample_size for the available methods.
     
     Reference:
       Zieba (2010). doi:10.2478/v10178-010-0001-0
     
     """
 
-    from statsmodels.tsa.stattools import acf
-
     # Data must be three dimensional, with time first
     assert len(data_subset.shape) == 3, "Input data must be 3 dimensional"
     
-    # Define autocorrelation function
     n = data_subset.shape[0]
-    autocorr_func = numpy.apply_along_axis(acf, 0, data_subset, nlags=n - 2)
-    
-    # Calculate effective sample size (formula from Zieba2010, eq 12)
-    k = numpy.arange(1, n - 1)
-    
-    r_k_sum = ((n - k[:, None, None]) / float(n)) * autocorr_func[1:] 
-    n_eff = float(n) / (1 + 2 * r_k_sum.sum(axis=0))
+    n_eff = effective_sample_size(data_subset, method=method, max_lag=max_lag)
     
-    # Calculate significance
-    var_x = data_subset.var(axis=0) / n_eff
-    tvals = (data_subset.mean(axis=0) - data_all.mean(axis=0)) / numpy.sqrt(var_x)
+    return calc_significance_from_moments(data_subset.mean(axis=0), data_subset.var(axis=0), n, n_eff,
+                                          data_all.mean(axis=0), standard_name, method=method, max_lag=max_lag)
+
+
+def calc_significance_from_moments(subset_mean, subset_var, n, n_eff, all_mean, standard_name, 
+                                   method='full', max_lag=None):
+    """Perform significance test given the sample moments.
+
+    Same test as calc_significance, for when the mean and (population) variance of the 
+    subset and mean of all the data have already been accumulated.
+
+    Args:
+      n (int): Sample size
+      n_eff (numpy.ndarray): Effective sample size (see effective_sample_size)
+      method, max_lag: Method used to calculate n_eff (for the metadata)
+
+    """
+
+    var_x = subset_var / n_eff
+    tvals = (subset_mean - all_mean) / numpy.sqrt(var_x)
     pvals = stats.t.sf(numpy.abs(tvals), n - 1) * 2  # two-sided pvalue = Prob(abs(t)>tt)
 
-    notes = "One sample t-test, with sample size adjusted for autocorrelation (Zieba2010, eq 12)" 
+    method_notes = {'full': 'Zieba2010, eq 12',
+                    'truncated': 'Zieba2010, eq 12 truncated at lag %s' %(str(max_lag)),
+                    'ar1': 'lag-1 autoregressive approximation'}
+    notes = "One sample t-test, with sample size adjusted for autocorrelation (%s)" %(method_notes[method]) 
     pval_atts = {'standard_name': standard_name,
                  'long_name': standard_name,
                  'units': ' ',
@@ -172,6 +186,84 @@ def dict_filter(indict, key_list):
     return dict((key, value) for key, value in indict.iteritems() if key in key_list)
 
 
+def effective_sample_size(data, method='full', max_lag=None, max_chunk=10000000):
+    """Calculate the effective sample size of autocorrelated data.
+
+    Formula from Zieba (2010), eq 12:
+      n_eff = n / (1 + 2 * sum_{k=1}^{n-2} ((n - k) / n) * r_k)
+
+    where r_k is the (biased, as per statsmodels acf) lag k autocorrelation.
+
+    Methods:
+      full      -- Sum over all n-2 lags. The autocovariance of every grid point is 
+                   obtained from one FFT along the time axis and the weighted sum over 
+                   lags is done in the frequency domain (via Parseval's theorem), so the 
+                   (n-2, lat, lon) lag array is never created. Grid points are processed 
+                   in chunks of no more than max_chunk FFT values.
+      truncated -- Sum over lags 1 to max_lag only (avoids the noisy long lags)
+      ar1       -- Lag-1 autoregressive approximation: n_eff = n (1 - r_1) / (1 + r_1)
+
+    Args:
+      data (numpy.ndarray): Time must be the first axis
+      method (str): full, truncated or ar1
+      max_lag (int): Maximum lag for the truncated method
+
+    """
+
+    n = data.shape[0]
+    spatial_shape = data.shape[1:]
+    data = data.reshape(n, -1)
+
+    if method == 'full':
+        n_eff = _n_eff_full(data, max_chunk)
+    elif method == 'truncated':
+        assert max_lag, "The truncated method requires a maximum lag"
+        anomalies = data - data.mean(axis=0)
+        acov0 = (anomalies**2).sum(axis=0)
+        r_k_sum = numpy.zeros(data.shape[1])
+        for k in xrange(1, min(max_lag, n - 2) + 1):
+            r_k = (anomalies[:-k, :] * anomalies[k:, :]).sum(axis=0) / acov0
+            r_k_sum = r_k_sum + ((n - k) / float(n)) * r_k
+        n_eff = float(n) / (1 + 2 * r_k_sum)
+    elif method == 'ar1':
+        anomalies = data - data.mean(axis=0)
+        r_1 = (anomalies[:-1, :] * anomalies[1:, :]).sum(axis=0) / (anomalies**2).sum(axis=0)
+        n_eff = n * (1 - r_1) / (1 + r_1)
+    else:
+        raise ValueError('Unrecognised effective sample size method: %s' %(method))
+
+    return n_eff.reshape(spatial_shape)
+
+
+def _n_eff_full(data, max_chunk):
+    """Effective sample size summing over all lags (data must be 2D, time first)."""
+
+    n = data.shape[0]
+
+    # Zero pad to avoid circular correlation
+    nfft = 2**int(numpy.ceil(numpy.log2(2 * n - 1)))
+    
+    # Frequency domain equivalent of the lag weights (n - k)
+    lag_weights = numpy.zeros(nfft)
+    lag_weights[1:n - 1] = n - numpy.arange(1, n - 1)
+    freq_weights = numpy.fft.rfft(lag_weights).real
+    freq_weights[1:-1] = 2 * freq_weights[1:-1]  # Account for the negative frequencies
+    freq_weights = freq_weights / nfft 
+
+    chunk = max(1, max_chunk // nfft)
+    n_eff = numpy.zeros(data.shape[1])
+    for start in xrange(0, data.shape[1], chunk):
+        end = start + chunk
+        anomalies = data[:, start:end] - data[:, start:end].mean(axis=0)
+        power = numpy.abs(numpy.fft.rfft(anomalies, n=nfft, axis=0))**2
+        
+        acov0 = (anomalies**2).sum(axis=0)
+        r_k_sum = numpy.dot(freq_weights, power) / (n * acov0)
+        n_eff[start:end] = float(n) / (1 + 2 * r_k_sum)
+
+    return n_eff
+
+
 def find_duplicates(inlist):
     """Return list of duplicates in a list."""
     
@@ -256,26 +348,39 @@ def list_kwargs(func):
 
 def match_dates(datetimes, datetime_axis):
     """Take list of datetimes and match with the corresponding datetimes in a time axis.
+
+    Matching is done on the date only (i.e. the time of day is ignored), 
+    by converting both to numpy.datetime64 day values and using a 
+    sort based membership test (rather than comparing strings).
  
     Args:   
-      datetimes (list/tuple)
-      datetime_axis (list/tuple)
+      datetimes (list/tuple): Date strings or numpy.datetime64 values
+      datetime_axis (list/tuple): Date strings or numpy.datetime64 values
+
+    Returns:
+      match_indexes, miss_indexes (numpy.ndarray): Positions in datetime_axis
+        that do and do not match a date in datetimes
         
     """
 
-    dates = map(split_dt, datetimes)
-    date_axis = map(split_dt, datetime_axis[:]) 
-    
-    match_datetimes = []
-    miss_datetimes = [] 
+    dates = _datetime64_days(datetimes)
+    date_axis = _datetime64_days(datetime_axis)
+
+    matches = numpy.in1d(date_axis, dates)
 
-    for i in range(0, len(datetime_axis)):
-        if date_axis[i] in dates:
-            match_datetimes.append(datetime_axis[i])
-        else:
-            miss_datetimes.append(datetime_axis[i])    
+    return numpy.where(matches)[0], numpy.where(~matches)[0]
+
+
+def _datetime64_days(datetimes):
+    """Convert a list of datetimes to an array of numpy.datetime64 days."""
+
+    values = numpy.asarray(datetimes)
+    if numpy.issubdtype(values.dtype, numpy.datetime64):
+        days = values.astype('datetime64[D]')
+    else:
+        days = numpy.array([split_dt(dt) for dt in values], dtype='datetime64[D]')
 
-    return match_datetimes, miss_datetimes
+    return days
 
 
 def split_dt(dt):
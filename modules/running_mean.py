@@ -0,0 +1,152 @@
+"""Collection of functions for calculating running (moving) means.
+
+The window sums are calculated from cumulative sums along the time axis,
+so the cost does not depend on the window length. Data can be processed
+in chunks (e.g. one slab of time steps read from file at a time), with the
+final window - 1 time steps carried over to the next chunk.
+
+Functions:
+  running_mean         -- Calculate the running mean along an axis
+  running_mean_chunks  -- Calculate the running mean of data supplied in chunks
+  running_mean_times   -- Time axis values for the running mean output
+
+Edge handling:
+  edges='valid' retains only the complete windows (like cdo runmean),
+    so the output is window - 1 time steps shorter than the input.
+  edges='nan' returns the same number of time steps as the input, with
+    NaN where the window is incomplete (like pandas rolling_mean).
+
+"""
+
+import numpy
+import pdb
+
+
+def _window_means(data, window):
+    """Calculate the mean of each complete window along axis 0.
+
+    NaN values are treated as missing (i.e. the mean of the valid values
+    in the window is returned, like the cdo runmean operator).
+
+    """
+
+    ntime = data.shape[0]
+    if ntime < window:
+        return numpy.zeros((0,) + data.shape[1:])
+
+    valid = ~numpy.isnan(data)
+    all_valid = valid.all()
+
+    cumsum = numpy.zeros((ntime + 1,) + data.shape[1:])
+    numpy.cumsum(data if all_valid else numpy.where(valid, data, 0), axis=0, out=cumsum[1:])
+    means = cumsum[window:] - cumsum[:-window]
+
+    if all_valid:
+        means /= window
+    else:
+        counts = numpy.zeros((ntime + 1,) + data.shape[1:])
+        numpy.cumsum(valid, axis=0, out=counts[1:])
+        counts = counts[window:] - counts[:-window]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            means = numpy.where(counts > 0, means / counts, numpy.nan)
+
+    return means
+
+
+def _edge_padding(window, centre):
+    """Number of incomplete windows at the start and end of the output (edges='nan')."""
+
+    if centre:
+        return window // 2, (window - 1) // 2
+    else:
+        return window - 1, 0
+
+
+def running_mean(data, window, axis=0, centre=True, edges='valid'):
+    """Calculate the running mean along an axis.
+
+    Args:
+      data (numpy.ndarray): N-dimensional data (NaN values are treated as missing)
+      window (int): Window length
+      axis (int): Axis along which to calculate the running mean
+      centre (bool): Centred (True) or trailing (False) window.
+        Only affects the position of the output for edges='nan'
+        (see running_mean_times for the corresponding time values).
+      edges (str): 'valid' or 'nan' (see module docstring)
+
+    """
+
+    assert edges in ['valid', 'nan']
+
+    chunks = running_mean_chunks([data], window, axis=axis, centre=centre, edges=edges)
+
+    return numpy.concatenate(list(chunks), axis=axis)
+
+
+def running_mean_chunks(chunks, window, axis=0, centre=True, edges='valid'):
+    """Calculate the running mean of data that is supplied in chunks.
+
+    This is a generator: the running mean is yielded as each chunk is
+    processed. The output chunks are identical to what running_mean
+    would return for the concatenated data.
+
+    Args:
+      chunks (iterable): numpy.ndarray chunks, split along axis
+      window (int): Window length
+      axis (int): Axis along which to calculate the running mean
+      centre (bool): Centred (True) or trailing (False) window
+      edges (str): 'valid' or 'nan' (see module docstring)
+
+    """
+
+    assert edges in ['valid', 'nan']
+    assert window >= 1
+
+    lead, trail = _edge_padding(window, centre)
+    carry = None
+    for chunk in chunks:
+        chunk = numpy.asarray(chunk, dtype=numpy.float64)
+        axis = axis % chunk.ndim
+        chunk = numpy.rollaxis(chunk, axis)
+        if carry is None:
+            if edges == 'nan':
+                yield numpy.rollaxis(numpy.nan * numpy.ones((lead,) + chunk.shape[1:]), 0, axis + 1)
+            data = chunk
+        else:
+            data = numpy.concatenate([carry, chunk])
+
+        means = _window_means(data, window)
+        carry = data[max(0, data.shape[0] - (window - 1)):]
+
+        yield numpy.rollaxis(means, 0, axis + 1)
+
+    if edges == 'nan' and carry is not None:
+        yield numpy.rollaxis(numpy.nan * numpy.ones((trail,) + carry.shape[1:]), 0, axis + 1)
+
+
+def running_mean_times(times, window, centre=True):
+    """Time axis values for the running mean output (edges='valid').
+
+    A centred window takes the time at the middle of the window, which
+    for an even window is half way between the two central times (like
+    the default cdo runmean time stamp). A trailing window takes the
+    time of the last step in the window.
+
+    Args:
+      times (numpy.ndarray): Input time axis values (numeric or numpy.datetime64)
+      window (int): Window length
+      centre (bool): Centred (True) or trailing (False) window
+
+    """
+
+    times = numpy.asarray(times)
+    nout = len(times) - window + 1
+
+    if centre:
+        first = times[(window - 1) // 2 : (window - 1) // 2 + nout]
+        second = times[window // 2 : window // 2 + nout]
+        out_times = first + (second - first) / 2
+    else:
+        out_times = times[window - 1:]
+
+    return out_times
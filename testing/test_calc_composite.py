@@ -0,0 +1,110 @@
+"""
+A unit testing module for the composite calculations.
+
+Functions/methods tested:
+    calc_composite.accumulate_moments
+    calc_composite.ar1_effective_sample_size
+    calc_composite.permutation_test
+
+"""
+
+import os, sys
+import unittest
+import numpy, pandas
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(repo_dir, 'modules'))
+sys.path.append(os.path.join(repo_dir, 'data_processing'))
+import convenient_universal as uconv
+import calc_composite
+
+
+##########################
+## unittest test clases ##
+##########################
+
+class testAR1EffectiveSampleSize(unittest.TestCase):
+    """Test class for the lag-1 effective sample size rebuilt from accumulated moments."""
+
+    def setUp(self):
+        """Define the test data (an AR(1) process) and some groups of time steps."""
+
+        numpy.random.seed(20)
+        noise = numpy.random.randn(300, 2, 3)
+        self.data = numpy.zeros(noise.shape)
+        self.data[0, ...] = noise[0, ...]
+        for t in range(1, noise.shape[0]):
+            self.data[t, ...] = 0.5 * self.data[t - 1, ...] + noise[t, ...]
+
+        self.groups = numpy.random.rand(3, 300) > 0.4
+        self.groups[2, :] = True
+
+
+    def test_ar1_vs_direct(self):
+        """Test against effective_sample_size(method='ar1') for each group [test for success]"""
+
+        sums, sums_sq, counts, lag1_terms = calc_composite.accumulate_moments(self.data, self.groups,
+                                                                              chunk_size=47, lag1=True)
+        result = calc_composite.ar1_effective_sample_size(sums, sums_sq, counts, lag1_terms)
+        for group in range(self.groups.shape[0]):
+            answer = uconv.effective_sample_size(self.data[self.groups[group, :], ...], method='ar1')
+            numpy.testing.assert_allclose(result[group, ...], answer, rtol=1e-10)
+
+
+    def test_chunk_size(self):
+        """Test that the lag-1 terms don't depend on the chunk size [test for success]"""
+
+        result = calc_composite.accumulate_moments(self.data, self.groups, chunk_size=13, lag1=True)
+        answer = calc_composite.accumulate_moments(self.data, self.groups, chunk_size=1000, lag1=True)
+        for result_term, answer_term in zip(result[3], answer[3]):
+            numpy.testing.assert_allclose(result_term, answer_term, rtol=1e-10)
+
+
+class testPermutationTest(unittest.TestCase):
+    """Test class for the permutation test with missing data and empty seasons."""
+
+    def setUp(self):
+        """Define the test data (two years of daily data and a DJF-only composite)."""
+
+        numpy.random.seed(40)
+        self.months = numpy.asarray(pandas.date_range('2000-01-01', '2001-12-31').month)
+        ntime = len(self.months)
+        self.data = numpy.random.randn(ntime, 2, 2)
+        self.data[5, 0, 0] = numpy.nan     # one missing value
+        self.data[:, 1, 1] = numpy.nan     # all missing
+
+        self.season_masks = calc_composite.get_season_masks(self.months)
+        self.selected = numpy.zeros(ntime, dtype=bool)
+        self.selected[::3] = True
+        self.selected = self.selected & self.season_masks[1, :]  # DJF only
+
+        groups = numpy.vstack([self.season_masks & self.selected, self.season_masks])
+        sums, sums_sq, counts, lag1_terms = calc_composite.accumulate_moments(self.data, groups)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            means = sums / counts
+        self.composite_means = means[:5, ...]
+        self.all_means = means[5:, ...]
+
+        self.pvals, self.null_lower, self.null_upper = calc_composite.permutation_test(self.data, self.selected, self.months, 
+                                                                                       self.season_masks, self.composite_means, 
+                                                                                       self.all_means, nresamples=99, seed=0)
+
+
+    def test_missing_data(self):
+        """Test that missing data only gives NaN p-values where the means are undefined [test for success]"""
+
+        for result in [self.pvals, self.null_lower, self.null_upper]:
+            self.assertTrue(numpy.isnan(result[:, 1, 1]).all())
+            self.assertTrue(numpy.isfinite(result[0:2, 0, 0]).all())
+            self.assertTrue(numpy.isfinite(result[0:2, 0, 1]).all())
+
+
+    def test_empty_season(self):
+        """Test that seasons with no composite days have NaN p-values [test for success]"""
+
+        for result in [self.pvals, self.null_lower, self.null_upper]:
+            self.assertTrue(numpy.isnan(result[2:, ...]).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+A unit testing module for the effective sample size calculation.
+
+Functions/methods tested:
+    convenient_universal.effective_sample_size
+
+"""
+
+import os, sys
+import unittest
+import numpy
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(repo_dir, 'modules'))
+import convenient_universal as uconv
+
+
+##########################
+## unittest test clases ##
+##########################
+
+class testEffectiveSampleSize(unittest.TestCase):
+    """Test class for the effective sample size of autocorrelated data."""
+
+    def setUp(self):
+        """Define the test data (an AR(1) process at a few grid points)."""
+
+        numpy.random.seed(10)
+        noise = numpy.random.randn(200, 3, 4)
+        self.data = numpy.zeros(noise.shape)
+        self.data[0, ...] = noise[0, ...]
+        for t in range(1, noise.shape[0]):
+            self.data[t, ...] = 0.6 * self.data[t - 1, ...] + noise[t, ...]
+
+
+    def direct_n_eff(self, max_lag=None):
+        """Zieba (2010) eq 12, summing the lag k autocorrelations one lag at a time."""
+
+        n = self.data.shape[0]
+        anomalies = self.data - self.data.mean(axis=0)
+        acov0 = (anomalies**2).sum(axis=0)
+        last_lag = min(max_lag, n - 2) if max_lag else n - 2
+
+        r_k_sum = numpy.zeros(acov0.shape)
+        for k in range(1, last_lag + 1):
+            r_k = (anomalies[:-k, ...] * anomalies[k:, ...]).sum(axis=0) / acov0
+            r_k_sum = r_k_sum + ((n - k) / float(n)) * r_k
+
+        return float(n) / (1 + 2 * r_k_sum)
+
+
+    def test_full(self):
+        """Test the FFT (Parseval) lag sum against the direct sum over all lags [test for success]"""
+
+        result = uconv.effective_sample_size(self.data, method='full')
+        answer = self.direct_n_eff()
+        numpy.testing.assert_allclose(result, answer, rtol=1e-10)
+
+
+    def test_full_chunked(self):
+        """Test that processing the grid points in chunks gives the same answer [test for success]"""
+
+        result = uconv.effective_sample_size(self.data, method='full', max_chunk=1000)
+        answer = uconv.effective_sample_size(self.data, method='full')
+        numpy.testing.assert_allclose(result, answer, rtol=1e-10)
+
+
+    def test_truncated(self):
+        """Test the truncated lag sum against the direct sum [test for success]"""
+
+        result = uconv.effective_sample_size(self.data, method='truncated', max_lag=10)
+        answer = self.direct_n_eff(max_lag=10)
+        numpy.testing.assert_allclose(result, answer, rtol=1e-10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+"""
+A unit testing module for the PSA event calculations.
+
+Functions/methods tested:
+    psa_date_list.grouped_slope
+    psa_date_list.fix_boundary_data
+    psa_date_list.event_info
+
+"""
+
+import os, sys
+import unittest
+import numpy, pandas
+from scipy.stats import linregress
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(repo_dir, 'modules'))
+sys.path.append(os.path.join(repo_dir, 'data_processing'))
+import psa_date_list
+
+
+##########################
+## unittest test clases ##
+##########################
+
+class testGroupedSlope(unittest.TestCase):
+    """Test class for the linear regression slope of each event."""
+
+    def setUp(self):
+        """Define the test data (groups of length 1 to 10)."""
+
+        numpy.random.seed(30)
+        lengths = numpy.random.randint(1, 11, size=20)
+        self.groups = numpy.repeat(numpy.arange(len(lengths)), lengths)
+        self.y = numpy.random.randn(len(self.groups)) * 10
+
+
+    def test_vs_linregress(self):
+        """Test against linregress applied to each group [test for success]"""
+
+        result = psa_date_list.grouped_slope(self.y, self.groups)
+        for group in range(self.groups.max() + 1):
+            y = self.y[self.groups == group]
+            if len(y) > 1:
+                answer = linregress(numpy.arange(len(y)), y)[0]
+                self.assertAlmostEqual(result[group], answer)
+            else:
+                self.assertTrue(numpy.isnan(result[group]))
+
+
+    def test_empty(self):
+        """Test for no groups [test for success]"""
+
+        result = psa_date_list.grouped_slope(numpy.zeros(0), numpy.zeros(0, dtype=int))
+        self.assertEqual(len(result), 0)
+
+
+class testFixBoundaryData(unittest.TestCase):
+    """Test class for adjusting phase series that straddle 0/60."""
+
+    def setUp(self):
+        """Define the test data (some groups straddle the 0/60 boundary)."""
+
+        self.data = numpy.array([55., 58., 2., 5.,    # straddles
+                                 20., 22., 25.,       # doesn't straddle
+                                 59., 1.,             # straddles
+                                 58., 57.,            # doesn't straddle (the jump is between groups)
+                                 40.])
+        self.groups = numpy.array([0, 0, 0, 0, 1, 1, 1, 2, 2, 3, 3, 4])
+
+
+    def test_vs_single_groups(self):
+        """Test against fix_boundary_data applied to each group separately [test for success]"""
+
+        result = psa_date_list.fix_boundary_data(self.data, 6, groups=self.groups)
+        answer = numpy.concatenate([psa_date_list.fix_boundary_data(self.data[self.groups == group], 6)
+                                    for group in range(self.groups.max() + 1)])
+        numpy.testing.assert_array_equal(result, answer)
+
+
+    def test_values(self):
+        """Test the adjusted values [test for success]"""
+
+        result = psa_date_list.fix_boundary_data(self.data, 6, groups=self.groups)
+        answer = [55., 58., 62., 65., 20., 22., 25., 59., 61., 58., 57., 40.]
+        numpy.testing.assert_array_equal(result, answer)
+
+
+class testEventInfo(unittest.TestCase):
+    """Test class for adding the event information to the table."""
+
+    def test_empty(self):
+        """Test for an empty table (e.g. after strict filtering) [test for success]"""
+
+        df = pandas.DataFrame({'wave6_phase': numpy.zeros(0)}, index=pandas.DatetimeIndex([]))
+        result = psa_date_list.event_info(df, 6)
+        self.assertEqual(len(result.index), 0)
+        for column in ['event_number', 'event_duration', 'event_phase', 'event_gradient', 'event_start', 'event_end']:
+            self.assertTrue(column in result.columns)
+
+
+if __name__ == '__main__':
+    unittest.main()
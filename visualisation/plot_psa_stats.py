@@ -5,6 +5,7 @@ import math
 import numpy
 import pandas
 import argparse
+import xray
 from scipy import stats
 from scipy.signal import argrelextrema
 import pyqt_fit
@@ -318,17 +319,37 @@ def plot_kde(ax, phase_data, bin_centers,
     return ax
 
 
+def read_stats(infile, columns):
+    """Read the PSA statistics file from psa_date_list.py.
+
+    For a columnar netCDF file only the requested columns are loaded
+    (the scipy engine memory-maps the file). A csv file is read in full.
+    The returned DataFrame has the dates in a 'time' column.
+
+    """
+
+    if infile[-3:] == '.nc':
+        dset = xray.open_dataset(infile, engine='scipy')
+        df = dset[columns].to_dataframe().reset_index()
+        dset.close()
+    else:
+        df = pandas.read_csv(infile)
+
+    return df
+
+
 def main(inargs):
     """Run program."""
 
     # Read the data and apply filters
-    df = pandas.read_csv(inargs.infile)
+    phase_freq = 'wave%i_phase' %(inargs.freq)
+    columns = ['event_number', 'event_duration', 'event_phase', 'event_gradient', 'env_max', phase_freq]
+    df = read_stats(inargs.infile, columns)
 
     # Create the desired plot
     dpi = inargs.dpi if inargs.dpi else plt.savefig.func_globals['rcParams']['figure.dpi']
     print 'dpi:', dpi
 
-    phase_freq = 'wave%i_phase' %(inargs.freq)
     if inargs.type == 'phase_distribution':
         filtered_df = df.loc[df['event_duration'] >= inargs.min_duration]
         plot_phase_distribution(filtered_df, phase_freq, inargs.freq, inargs.phase_res, inargs.ofile, dpi,
@@ -364,7 +385,7 @@ author:
                                      formatter_class=argparse.RawDescriptionHelpFormatter)
 
     # Required data
-    parser.add_argument("infile", type=str, help="PSA statistics file from psa_date_list.py")
+    parser.add_argument("infile", type=str, help="PSA statistics file from psa_date_list.py (csv or netCDF)")
     parser.add_argument("type", type=str, choices=("phase_distribution", "event_summary"), 
                         help="Desired plot")    
     parser.add_argument("ofile", type=str, help="Output file name")
@@ -81,10 +81,10 @@ def main(inargs):
         print subset_file
         if subset_file == 'all':
             subset_file = None
-        dt_list, metadata = calc_composite.get_datetimes(dataframe, subset_file)
+        date_indexes, metadata = calc_composite.get_date_indexes(dataframe, subset_file)
         if subset_file:
             metadata_dict[subset_file] = metadata
-        dataframe_selection = dataframe[dataframe.index.isin(dt_list)]
+        dataframe_selection = dataframe.iloc[date_indexes]
 
         g.x = dataframe_selection[inargs.xvar].values
         g.y = dataframe_selection[inargs.yvar].values
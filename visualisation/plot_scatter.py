@@ -189,8 +189,8 @@ def main(inargs):
         filtered = True
 
     if inargs.date_filter:
-        dt_list, metadata_dict[inargs.date_filter] = calc_composite.get_datetimes(dataframe, inargs.date_filter)
-        dataframe = dataframe[dataframe.index.isin(dt_list)]
+        date_indexes, metadata_dict[inargs.date_filter] = calc_composite.get_date_indexes(dataframe, inargs.date_filter)
+        dataframe = dataframe.iloc[date_indexes]
         filtered = True
 
     # Get the quadrant labels
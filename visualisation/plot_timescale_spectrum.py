@@ -8,7 +8,7 @@ Description:  Plot some periodograms
 # Import general Python modules
 
 import os, sys, pdb, itertools
-import numpy, pandas
+import numpy
 import argparse
 import xray
 
@@ -34,6 +34,7 @@ anal_dir = os.path.join(repo_dir, 'data_processing')
 sys.path.append(anal_dir)
 try:
     import general_io as gio
+    import running_mean as rmean
     import calc_fourier_transform as cft
     import calc_composite
 except ImportError:
@@ -43,13 +44,21 @@ except ImportError:
 # Define functions
 
 def running_mean(darray, window):
-    """Calculate the running mean."""
+    """Calculate the centred running mean along the time axis.
 
-    dframe = darray.to_pandas()
-    dframe = pandas.rolling_mean(dframe, window, center=True)
-    dframe = dframe.dropna()
+    Only complete windows are retained, each labelled with the time
+    step at (or just after, for an even window) the window centre.
 
-    return xray.DataArray(dframe)
+    """
+
+    time_axis = darray.dims.index('time')
+    data = rmean.running_mean(darray.values, window, axis=time_axis, centre=True)
+
+    offset = window // 2
+    darray = darray.isel(time=slice(offset, offset + data.shape[time_axis])).copy()
+    darray.values = data
+
+    return darray
 
 
 def subset_data(dset_in, inargs):
@@ -114,8 +123,8 @@ def composite_plot(ax, inargs, runave=30, label=None):
     for date_file, leglabel in inargs.date_curve:
         if date_file == 'all':
             date_file = None        
-        match_dates, date_metadata = calc_composite.get_datetimes(darray, date_file)
-        data_filtered = darray.sel(time=match_dates)
+        date_indexes, date_metadata = calc_composite.get_date_indexes(darray, date_file)
+        data_filtered = darray.isel(time=date_indexes)
 
         spectrum_temporal_mean, spectrum_freqs_1D = transform_data(data_filtered.values, indep_var, inargs.scaling)
 
@@ -31,8 +31,7 @@ ${SF_ORIG} : ${U_ORIG} ${V_ORIG}
 
 SF_ANOM_RUNMEAN=${DATA_DIR}/sf_${DATASET}_${LEVEL}_${TSCALE_LABEL}-anom-wrt-all_native.nc
 ${SF_ANOM_RUNMEAN} : ${SF_ORIG} 
-	cdo ${TSCALE} -ydaysub $< -ydayavg $< $@
-	bash ${DATA_SCRIPT_DIR}/fix_time_bounds.sh $@ ${PYTHON} ${DATA_SCRIPT_DIR}
+	${PYTHON} ${DATA_SCRIPT_DIR}/calc_daily_anomaly.py $< $@ --runmean ${RUNMEAN_WINDOW}
 
 SF_ZONAL_ANOM=${DATA_DIR}/sf_${DATASET}_${LEVEL}_daily_native-zonal-anom.nc
 ${SF_ZONAL_ANOM} : ${SF_ORIG}		
@@ -51,32 +50,28 @@ ${VROT_ORIG} : ${U_ORIG} ${V_ORIG}
 
 VROT_ANOM_DAILY=${DATA_DIR}/vrot_${DATASET}_${LEVEL}_daily-anom-wrt-all_native-${NPLABEL}.nc
 ${VROT_ANOM_DAILY} : ${VROT_ORIG} 
-	cdo ydaysub $< -ydayavg $< $@
+	${PYTHON} ${DATA_SCRIPT_DIR}/calc_daily_anomaly.py $< $@
 
 VROT_ANOM_RUNMEAN=${DATA_DIR}/vrot_${DATASET}_${LEVEL}_${TSCALE_LABEL}-anom-wrt-all_native-${NPLABEL}.nc
 ${VROT_ANOM_RUNMEAN} : ${VROT_ORIG} 
-	cdo ${TSCALE} -ydaysub $< -ydayavg $< $@
-	bash ${DATA_SCRIPT_DIR}/fix_time_bounds.sh $@ ${PYTHON} ${DATA_SCRIPT_DIR}
+	${PYTHON} ${DATA_SCRIPT_DIR}/calc_daily_anomaly.py $< $@ --runmean ${RUNMEAN_WINDOW}
 
 ## Composite variables (tas, pr, sic)
 
 TAS_ORIG=${DATA_DIR}/tas_${DATASET}_surface_daily_native.nc
 TAS_ANOM_RUNMEAN=${DATA_DIR}/tas_${DATASET}_surface_${TSCALE_LABEL}-anom-wrt-all_native.nc
 ${TAS_ANOM_RUNMEAN} : ${TAS_ORIG} 
-	cdo ${TSCALE} -ydaysub $< -ydayavg $< $@
-	bash ${DATA_SCRIPT_DIR}/fix_time_bounds.sh $@ ${PYTHON} ${DATA_SCRIPT_DIR}
+	${PYTHON} ${DATA_SCRIPT_DIR}/calc_daily_anomaly.py $< $@ --runmean ${RUNMEAN_WINDOW}
 
 PR_ORIG=${DATA_DIR}/pr_${DATASET}_surface_daily_native.nc
 PR_ANOM_RUNMEAN=${DATA_DIR}/pr_${DATASET}_surface_${TSCALE_LABEL}-anom-wrt-all_native.nc
 ${PR_ANOM_RUNMEAN} : ${PR_ORIG} 
-	cdo ${TSCALE} -ydaysub $< -ydayavg $< $@
-	bash ${DATA_SCRIPT_DIR}/fix_time_bounds.sh $@ ${PYTHON} ${DATA_SCRIPT_DIR}
+	${PYTHON} ${DATA_SCRIPT_DIR}/calc_daily_anomaly.py $< $@ --runmean ${RUNMEAN_WINDOW}
 
 SIC_ORIG=${DATA_DIR}/sic_${DATASET}_surface_daily_native.nc
 SIC_ANOM_RUNMEAN=${DATA_DIR}/sic_${DATASET}_surface_${TSCALE_LABEL}-anom-wrt-all_native.nc
 ${SIC_ANOM_RUNMEAN} : ${SIC_ORIG} 
-	cdo ${TSCALE} -ydaysub $< -ydayavg $< $@
-	bash ${DATA_SCRIPT_DIR}/fix_time_bounds.sh $@ ${PYTHON} ${DATA_SCRIPT_DIR}
+	${PYTHON} ${DATA_SCRIPT_DIR}/calc_daily_anomaly.py $< $@ --runmean ${RUNMEAN_WINDOW}
 
 ## Southern Annular Mode
 
@@ -130,7 +125,7 @@ ${FILTERED_DATES_PSA} : ${FOURIER_COEFFICIENTS}
 
 ## PSA stats lists
 
-ALL_STATS_PSA=${PSA_DIR}/stats-psa_${DATASET}_${LEVEL}-${LAT_LABEL}-${LON_LABEL}_${TSCALE_LABEL}-anom-wrt-all_native-${NPLABEL}.csv 
+ALL_STATS_PSA=${PSA_DIR}/stats-psa_${DATASET}_${LEVEL}-${LAT_LABEL}-${LON_LABEL}_${TSCALE_LABEL}-anom-wrt-all_native-${NPLABEL}.nc 
 ${ALL_STATS_PSA} : ${FOURIER_COEFFICIENTS}
 	${PYTHON} ${DATA_SCRIPT_DIR}/psa_date_list.py $< $@ --full_stats
 
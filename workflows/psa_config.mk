@@ -23,6 +23,7 @@ DATASET=ERAInterim
 LEVEL=500hPa
 TSTEP=daily
 TSCALE=runmean,30
+RUNMEAN_WINDOW=30
 TSCALE_LABEL=030day-runmean
 
 ## Analysis
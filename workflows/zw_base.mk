@@ -47,7 +47,7 @@ ${SF_ORIG} : ${U_ORIG} ${V_ORIG}
 
 SF_ANOM_RUNMEAN=${DATA_DIR}/sf_${DATASET}_${LEVEL}_${TSCALE_LABEL}-anom-wrt-all_native.nc
 ${SF_ANOM_RUNMEAN} : ${SF_ORIG} 
-	cdo ${TSCALE} -ydaysub $< -ydayavg $< $@
+	${PYTHON} ${DATA_SCRIPT_DIR}/calc_daily_anomaly.py $< $@ --runmean ${RUNMEAN_WINDOW}
 
 SF_ZONAL_ANOM=${DATA_DIR}/sf_${DATASET}_${LEVEL}_daily_native-zonal-anom.nc
 ${SF_ZONAL_ANOM} : ${SF_ORIG}       
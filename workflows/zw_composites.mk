@@ -22,7 +22,7 @@ all : ${TARGET}
 CVAR_ORIG=${DATA_DIR}/${COMP_VAR}_${DATASET}_surface_daily_native.nc
 CVAR_ANOM_RUNMEAN=${DATA_DIR}/${COMP_VAR}_${DATASET}_surface_${TSCALE_LABEL}-anom-wrt-all_native.nc
 ${CVAR_ANOM_RUNMEAN} : ${CVAR_ORIG} 
-	cdo ${TSCALE} -ydaysub $< -ydayavg $< $@
+	${PYTHON} ${DATA_SCRIPT_DIR}/calc_daily_anomaly.py $< $@ --runmean ${RUNMEAN_WINDOW}
 
 
 # Streamfunction composites (for contours)
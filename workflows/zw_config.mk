@@ -22,6 +22,7 @@ DATASET=ERAInterim
 LEVEL=500hPa
 TSTEP=daily
 TSCALE=runmean,30
+RUNMEAN_WINDOW=30
 TSCALE_LABEL=030day-runmean
 START=1979-01-01
 END=2014-12-31